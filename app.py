@@ -3,9 +3,25 @@ import subprocess
 import json
 import time
 import os
+import sys
+import io
+import importlib
+import contextlib
+import queue
+import threading
+import uuid
+import shlex
+import tarfile
+import hashlib
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import ansible_runner
 import psutil
 
+import results_store
+import compare
+
 app = Flask(__name__)
 
 LOCAL_SCRIPT_DIR = "/root/profiler/scripts"
@@ -13,6 +29,28 @@ RESULTS_DIR = "/root/profiler/results"
 LOCAL_BINARY_PATH = "/root/profiler/compiled"
 LOCAL_RESULTS_PATH = "/root/profiler/results"
 VPN_SCRIPT_PATH = "/root/vpn_con/vpn.sh"
+ANSIBLE_DIR = "/root/profiler/ansible"
+POOL_INVENTORY = os.path.join(ANSIBLE_DIR, "pool_inventory.json")  # Generated from the "hosts" list in the vm config
+JOBS_RESULTS_DIR = "/root/profiler/results/jobs"
+SUPPORT_SCRIPTS = ["stats.py", "container_pool.py", "docker_api.py", "rapl_reader.py", "aot.py", "topology.py",
+                   "quiet_host.py", "compile.py", "compile_cache.py", "runtimes.py",
+                   "vm_driver.py"]  # Helper modules the test scripts import on the VM, and the driver that runs them
+VM_ARCHIVE = "results.tar.gz"  # Written by vm_driver.py, fetched once per host
+VM_STATUS_FILE = "driver_status.json"  # Per-cell return codes and stderr, shipped in the archive
+SYNC_STATE_DIR = "/root/profiler/cache/sync"  # Content hashes of what each VM already has, one file per host
+LOCAL_WORKERS = 1  # Local measurements run one at a time so they don't disturb each other
+EXCLUSIVE_TESTS = ["rapl.py", "doc_rapl.py"]  # Package RAPL counts every core, so these never share the host
+JOB_WORKERS = 1  # Jobs share the host and VM, so by default they run one after another
+JOB_QUEUE_SIZE = 16
+
+local_pool = None
+local_pool_workers = 0
+local_pool_lock = threading.Lock()
+progress_manager = None
+jobs = {}
+jobs_lock = threading.Lock()
+job_queue = queue.Queue(maxsize=JOB_QUEUE_SIZE)
+job_workers = []
 
 def is_vpn_connected():
     """Check if the VPN connection is active by looking for the VPN interface."""
@@ -43,46 +81,333 @@ def initialize_vpn_connection():
         print(f"Failed to establish VPN connection: {e}")
         raise e
 
-def run_ansible_playbook(application_name, opt_levels, tests, vm_config):
+def format_cli_args(args):
+    """Turn a test's "args" from the config into command line flags for the VM."""
+    flags = []
+    for key, value in args.items():
+        flag = f"--{key.replace('_', '-')}"
+        if value is True:
+            flags.append(flag)
+        elif value is False or value is None:
+            continue
+        elif isinstance(value, list):
+            flags += [flag] + [shlex.quote(str(v)) for v in value]
+        else:
+            flags += [flag, shlex.quote(str(value))]
+    return ' '.join(flags)
+
+class HostUnreachable(Exception):
+    pass
+
+def vm_hosts(vm_config):
+    """Names of the VMs to shard over: the config's "hosts" pool, or the [vms] group of the inventory file."""
+    if vm_config.get('hosts'):
+        return [host.get('name', host['hostname']) for host in vm_config['hosts']]
+    names, in_group = [], False
+    with open(os.path.join(ANSIBLE_DIR, 'inventory'), 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('['):
+                in_group = line == '[vms]'
+            elif in_group and line and not line.startswith(('#', ';')):
+                names.append(line.split()[0])
+    return names
+
+def write_pool_inventory(vm_config):
+    # "connection" lets local or docker stand-ins take the place of real VMs
+    hosts = {}
+    for host in vm_config['hosts']:
+        host_vars = {'ansible_host': host['hostname'],
+                     'ansible_ssh_common_args': '-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null'}
+        if host.get('username'):
+            host_vars['ansible_user'] = host['username']
+        if host.get('password'):
+            host_vars['ansible_ssh_pass'] = host['password']
+        if host.get('connection'):
+            host_vars['ansible_connection'] = host['connection']
+        hosts[host.get('name', host['hostname'])] = host_vars
+    with open(POOL_INVENTORY, 'w') as f:
+        json.dump({'all': {'children': {'vms': {'hosts': hosts}}}}, f, indent=4)
+    return POOL_INVENTORY
+
+def shard_cells(cells, hosts):
+    # Contiguous chunks keep an application's (and opt level's) cells together, so each host copies fewer binaries
+    cells = sorted(cells, key=lambda cell: cell[:2])
+    size, extra = divmod(len(cells), len(hosts))
+    shards, start = {}, 0
+    for i, host in enumerate(hosts):
+        end = start + size + (1 if i < extra else 0)
+        if end > start:
+            shards[host] = cells[start:end]
+        start = end
+    return shards
+
+def vm_result_file(local_results_path, host, application_name, opt_level, test_name):
+    test_name_without_py = test_name.replace('.py', '')
+    return f"{local_results_path}/vm_results/{host}/{test_name_without_py}/{application_name}_{opt_level}_{test_name_without_py}.json"
+
+def extract_vm_archive(local_results_path, host):
+    host_dir = f"{local_results_path}/vm_results/{host}"
+    archive = os.path.join(host_dir, VM_ARCHIVE)
+    if not os.path.exists(archive):
+        return
+    with tarfile.open(archive, "r:gz") as tar:
+        tar.extractall(host_dir, filter='data')
+    os.remove(archive)
+
+def read_vm_status(local_results_path, host):
+    """The driver's outcome of each cell on a host, keyed like the cells: (app, opt level, test)."""
+    status = read_json_file(f"{local_results_path}/vm_results/{host}/{VM_STATUS_FILE}")
+    if not isinstance(status, list):
+        return {}
+    return {(cell["application_name"], cell["opt_level"], cell["test"]): cell for cell in status}
+
+def vm_cell_error(host, cell_status):
+    stderr = cell_status.get("stderr", "").strip()
+    return {"error": f"Exited with code {cell_status['returncode']} on {host}: "
+                     f"{stderr.splitlines()[-1] if stderr else 'no output'}",
+            "host": host, "returncode": cell_status["returncode"], "stderr": stderr}
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_sync_state(host):
+    try:
+        with open(os.path.join(SYNC_STATE_DIR, f"{host}.json"), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_sync_state(host, state):
+    os.makedirs(SYNC_STATE_DIR, exist_ok=True)
+    state_file = os.path.join(SYNC_STATE_DIR, f"{host}.json")
+    with open(f"{state_file}.tmp", 'w') as f:
+        json.dump(state, f, indent=4)
+    os.replace(f"{state_file}.tmp", state_file)
+
+def application_binaries(application_name, opt_levels):
+    # Build variants (e.g. _time_native) travel along with the plain binaries when they exist
+    names = []
+    for opt_level in opt_levels:
+        prefix = f"{application_name}_{opt_level}"
+        names += sorted(name for name in os.listdir(LOCAL_BINARY_PATH)
+                        if name == f"{prefix}.wasm" or name.startswith(f"{prefix}_"))
+    return [os.path.join(LOCAL_BINARY_PATH, name) for name in names]
+
+def build_sync_bundles(host, files_by_dest, staging_dir, force=False):
+    """Pack the files the host is missing or has an old copy of, one tar.gz per destination directory."""
+    state = {} if force else load_sync_state(host)
+    new_state = dict(state)
+    bundles = {}
+    for dest, files in files_by_dest.items():
+        changed = []
+        for path in files:
+            key = f"{dest}/{os.path.basename(path)}"
+            digest = file_digest(path)
+            if state.get(key) != digest:
+                changed.append(path)
+                new_state[key] = digest
+        if changed:
+            bundle = os.path.join(staging_dir, f"{len(bundles)}.tar.gz")
+            with tarfile.open(bundle, "w:gz") as tar:
+                for path in changed:
+                    tar.add(path, arcname=os.path.basename(path))
+            bundles[dest] = {"bundle": bundle, "files": len(changed)}
+    return bundles, new_state
+
+def run_ansible_playbook(cells, tests, vm_config, local_results_path=LOCAL_RESULTS_PATH, results_path=None,
+                         cancel_event=None, host=None, inventory=None):
+    tests_by_name = {test['name']: {**test, 'cli_args': format_cli_args(test.get('args', {}))} for test in tests}
+    shard_tests = [tests_by_name[name] for name in dict.fromkeys(name for _, _, name in cells)]
+    results_path = results_path or vm_config['results_path']
+    # The whole shard goes over as one manifest that vm_driver.py works through in a single task
+    manifest = {
+        'cells': [{'application_name': application_name, 'opt_level': opt_level, 'test': tests_by_name[name]}
+                  for application_name, opt_level, name in cells],
+        'script_path': vm_config['script_path'],
+        'results_path': results_path,
+        'shutdown_warm_containers': any(test.get('args', {}).get('warm') for test in shard_tests)
+    }
     extra_vars = {
-        'application_name': application_name,
-        'opt_levels': opt_levels,
-        'tests': tests,
+        'manifest': manifest,
         'binary_path': vm_config['binary_path'],
         'script_path': vm_config['script_path'],
-        'results_path': vm_config['results_path'],
-        'local_binary_path': LOCAL_BINARY_PATH,
-        'local_scripts': [f"{LOCAL_SCRIPT_DIR}/{script['name']}" for script in tests],
-        'local_results_path': LOCAL_RESULTS_PATH,
-        'binary_copy_required': True
+        'results_path': results_path,
+        'local_results_path': local_results_path
     }
-    
-    r = ansible_runner.run(private_data_dir='/root/profiler/ansible', playbook='playbook.yml', extravars=extra_vars, cmdline="-i inventory", quiet=False)
+    cancel_callback = cancel_event.is_set if cancel_event else None
+
+    # Only binaries and scripts whose hash differs from what the host last received are sent
+    with tempfile.TemporaryDirectory() as staging_dir:
+        files_by_dest = {
+            vm_config['binary_path']: [path for application_name, opt_level in dict.fromkeys(cell[:2] for cell in cells)
+                                       for path in application_binaries(application_name, [opt_level])],
+            vm_config['script_path']: [f"{LOCAL_SCRIPT_DIR}/{script}" for script in [t['name'] for t in shard_tests] + SUPPORT_SCRIPTS]
+        }
+        bundles, sync_state = build_sync_bundles(host, files_by_dest, staging_dir, vm_config.get('force_sync', False))
+        extra_vars['sync_bundles'] = [{'src': bundle['bundle'], 'dest': dest} for dest, bundle in bundles.items()]
+        for dest, bundle in bundles.items():
+            yield f"Syncing {bundle['files']} changed file(s) to {host}:{dest}\n"
+        if not bundles:
+            yield f"{host} is up to date, nothing to copy\n"
+
+        r = ansible_runner.run(private_data_dir=ANSIBLE_DIR, playbook='playbook.yml', extravars=extra_vars, cmdline="-i inventory", quiet=False,
+                               cancel_callback=cancel_callback, inventory=inventory, limit=host,
+                               ident=f"{host or 'vms'}-{uuid.uuid4().hex[:8]}")
     
     for event in r.events:
         if 'event_data' in event and 'stdout' in event['event_data']:
             yield event['event_data']['stdout'] + '\n'
-    
+
+    if r.rc == 0:
+        save_sync_state(host, sync_state)
+    if host and host in (r.stats or {}).get('dark', {}):
+        raise HostUnreachable(f"VM {host} is unreachable")
     if r.rc != 0:
         raise Exception(f"Ansible playbook failed")
 
-def run_vm_tests(application_name, opt_levels, vm_tests, vm_config):
+def run_vm_tests(applications, opt_levels, vm_tests, vm_config, local_results_path=LOCAL_RESULTS_PATH,
+                 results_path=None, cancel_event=None):
+    """Shard the (app x opt level x test) matrix over the VM pool; returns which host produced each cell, and
+    the driver's error for each cell that failed."""
     initialize_vpn_connection()
+    inventory = write_pool_inventory(vm_config) if vm_config.get('hosts') else None
+    live_hosts = vm_hosts(vm_config)
+    pending = [(application_name, opt_level, test['name'])
+               for application_name in applications for opt_level in opt_levels for test in vm_tests]
+    cell_hosts = {}
+    cell_errors = {}
+
+    while pending and live_hosts:
+        shards = shard_cells(pending, live_hosts)
+        lost_hosts = []
+
+        def run_shard(host, cells):
+            for cell in cells:
+                stale = vm_result_file(local_results_path, host, *cell)
+                if os.path.exists(stale):
+                    os.remove(stale)
+            stale_status = f"{local_results_path}/vm_results/{host}/{VM_STATUS_FILE}"
+            if os.path.exists(stale_status):
+                os.remove(stale_status)
+            for application_name, opt_level, test_name in cells:
+                yield {"type": "cell_start", "app": application_name, "test": test_name, "opt_level": opt_level,
+                       "host": host}
+            try:
+                yield from run_ansible_playbook(cells, vm_tests, vm_config, local_results_path, results_path,
+                                                cancel_event, host, inventory)
+                extract_vm_archive(local_results_path, host)
+                yield f"Completed running tests on VM {host}...\n"
+            except HostUnreachable as e:
+                lost_hosts.append(host)
+                yield {"type": "error", "host": host, "message": f"Lost VM {host}: {str(e)}\n"}
+                return
+            except Exception as e:
+                yield {"type": "error", "host": host, "message": f"Failed to run Ansible playbook on {host}: {str(e)}\n"}
+            # A shard's results arrive together in its archive, with the driver's status of every cell
+            status = read_vm_status(local_results_path, host)
+            for application_name, opt_level, test_name in cells:
+                cell = {"app": application_name, "test": test_name, "opt_level": opt_level, "host": host}
+                result_file = vm_result_file(local_results_path, host, application_name, opt_level, test_name)
+                cell_status = status.get((application_name, opt_level, test_name))
+                if os.path.exists(result_file):
+                    cell_errors.pop((application_name, opt_level, test_name), None)
+                    yield {"type": "cell_result", **cell, "result": read_json_file(result_file)}
+                elif cell_status and cell_status["returncode"] != 0:
+                    error = vm_cell_error(host, cell_status)
+                    cell_errors[(application_name, opt_level, test_name)] = error
+                    yield {"type": "error", **cell, "message": f"{test_name} failed for {application_name} at opt level "
+                                                               f"{opt_level}: {error['error']}\n"}
+
+        yield from run_concurrently([run_shard(host, cells) for host, cells in shards.items()])
+
+        for host, cells in shards.items():
+            for cell in cells:
+                if os.path.exists(vm_result_file(local_results_path, host, *cell)):
+                    cell_hosts[cell] = host
+
+        # Only cells of hosts that went away are retried; a test failing on a healthy host stays failed
+        live_hosts = [host for host in live_hosts if host not in lost_hosts]
+        pending = [cell for host in lost_hosts for cell in shards[host] if cell not in cell_hosts]
+        if cancel_event and cancel_event.is_set():
+            break
+        if pending and live_hosts:
+            yield f"Moving {len(pending)} cell(s) to {', '.join(live_hosts)}...\n"
+
+    if pending:
+        yield {"type": "error", "message": f"No VM left to run {len(pending)} cell(s)\n"}
+    return cell_hosts, cell_errors
+
+def get_local_pool(workers=LOCAL_WORKERS):
+    # Long-lived workers keep the scripts imported between cells; the pool only grows for parallel runs
+    global local_pool, local_pool_workers
+    with local_pool_lock:
+        if local_pool is None or local_pool_workers < workers:
+            if local_pool is not None:
+                local_pool.shutdown(wait=True)
+            local_pool = ProcessPoolExecutor(max_workers=workers)
+            local_pool_workers = workers
+        return local_pool
+
+def import_script(script_name):
+    if LOCAL_SCRIPT_DIR not in sys.path:
+        sys.path.insert(0, LOCAL_SCRIPT_DIR)
+    return importlib.import_module(script_name.replace('.py', ''))
+
+def get_progress_queue():
+    # Manager queues can be handed to pool workers, which report sample batches through them
+    global progress_manager
+    if progress_manager is None:
+        progress_manager = multiprocessing.Manager()
+    return progress_manager.Queue()
+
+def run_local_test(script_name, application_name, opt_level, results_dir=None, args=None, progress=None, lease=None):
+    """Run a profiling script's main() inside a pool worker and capture its output."""
+    module = import_script(script_name)
+    stats = import_script('stats.py')
+    topology = import_script('topology.py')
+    kwargs = dict(args or {})
+    if results_dir:
+        kwargs["results_dir"] = results_dir
+    output = io.StringIO()
+    stats.progress_hook = progress.put if progress is not None else None
+    # Whichever worker picks the cell up moves onto the leased core and memory node for its duration
+    topology.pin(lease)
     try:
-        for line in run_ansible_playbook(application_name, opt_levels, vm_tests, vm_config):
-            yield line
-        yield f"Completed running tests on VM {vm_config['hostname']}...\n"
-    except Exception as e:
-        yield f"Failed to run Ansible playbook: {str(e)}\n"
+        with contextlib.redirect_stdout(output):
+            result = module.main(application_name, opt_level, **kwargs)
+    finally:
+        stats.progress_hook = None
+        topology.pin(None)
+    return result, output.getvalue()
+
+def shutdown_warm_containers():
+    return import_script('container_pool.py').shutdown()
 
-def run_local_script(script_name, application_name, opt_level):
+def run_local_script(script_name, application_name, opt_level, results_dir=None, args=None, lease=None):
+    """Yields sample batch events while the script runs; returns (result, output, error)."""
     try:
-        command = ['python3', f'{LOCAL_SCRIPT_DIR}/{script_name}', application_name, str(opt_level)]
-        print(f"Executing local command: {' '.join(command)}")
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        return result.stdout.strip(), None
-    except subprocess.CalledProcessError as e:
-        return None, f"Error: {e}"
+        print(f"Executing local test: {script_name} {application_name} {opt_level}")
+        progress = get_progress_queue()
+        future = get_local_pool().submit(run_local_test, script_name, application_name, opt_level, results_dir, args,
+                                         progress, lease)
+        while True:
+            done = future.done()
+            while not progress.empty():
+                batch = progress.get()
+                yield {"type": "samples", "app": application_name, "test": script_name, "opt_level": opt_level,
+                       "host": "local", **batch}
+            if done:
+                break
+            time.sleep(0.2)
+        result, output = future.result()
+        return result, output.strip(), None
+    except Exception as e:
+        return None, None, f"Error: {e}"
 
 def read_json_file(filepath):
     try:
@@ -91,103 +416,594 @@ def read_json_file(filepath):
     except Exception as e:
         return {"error": str(e)}
 
-def collect_vm_results(application_name, opt_levels, vm_tests, results):
+def collect_vm_results(application_name, opt_levels, vm_tests, results, local_results_path=LOCAL_RESULTS_PATH,
+                       cell_hosts=None, cell_errors=None):
+    cell_hosts = cell_hosts or {}
+    cell_errors = cell_errors or {}
     for opt_level in opt_levels:
         level_key = f"optimization_level_{opt_level}"
         if level_key not in results:
             results[level_key] = {}
         for test in vm_tests:
             test_name = test["name"]
-            test_name_without_py = test_name.replace('.py', '')
+            host = cell_hosts.get((application_name, opt_level, test_name))
+            cell_error = cell_errors.get((application_name, opt_level, test_name))
             try:
-                # Define the new path to which the VM result files are fetched
-                vm_result_file_path = f"{LOCAL_RESULTS_PATH}/vm_results/{test_name_without_py}/{application_name}_{opt_level}_{test_name_without_py}.json"
-                if os.path.exists(vm_result_file_path):
+                # Each VM's result files are fetched into a directory of their own
+                results[level_key].setdefault("vm_hosts", {})[test_name] = host or (cell_error or {}).get("host")
+                vm_result_file_path = vm_result_file(local_results_path, host, application_name, opt_level, test_name)
+                if host and os.path.exists(vm_result_file_path):
                     test_results = read_json_file(vm_result_file_path)
                     results[level_key][f"{test_name}_vm"] = test_results
+                elif cell_error:
+                    results[level_key][f"{test_name}_vm"] = cell_error
                 else:
                     results[level_key][f"{test_name}_vm"] = {"error": "Result file not found"}
             except Exception as e:
                 results[level_key][f"{test_name}_vm"] = {"error": str(e)}
 
-@app.route('/run_profiling', methods=['POST'])
-def run_profiling():
-    @stream_with_context
-    def generate():
-        data = request.json
-        application_name = data.get('application_name')
-        opt_levels = data.get('opt_levels')
-        config_file = data.get('config_file', 'config.json')
-        
-        with open(config_file, 'r') as file:
-            config = json.load(file)
-        
-        local_tests = [t for t in config.get('local_tests', []) if t['active']]
-        vm_tests = [t for t in config.get('vm_tests', []) if t['active']]
-        vm_config = config.get('vm')
-        if not opt_levels:
-            opt_levels = config.get('optimization_levels', [0, 1, 2, 3])
-        
-        results = {}
-        start_time = time.time()
+class JobCancelled(Exception):
+    pass
+
+def run_compile_matrix(applications, opt_levels, results_dir=None, args=None):
+    """Build every (app x opt level x target) in one compile.py matrix inside a pool worker."""
+    compile_script = import_script('compile.py')
+    args = dict(args or {})
+    kwargs = {"results_dir": results_dir} if results_dir else {}
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        # Cache hits are reused; "measure_times" or "force" in the test's args make it compile for real
+        compile_times = compile_script.build_matrix(applications, opt_levels, measure_times=args.get('measure_times', False),
+                                                    force=args.get('force', False), variant=args.get('variant'),
+                                                    dataset=args.get('dataset'), **kwargs)
+    return compile_times, output.getvalue()
+
+def run_local_cell(application_name, opt_level, test, level_results, results_dir=None, lease=None):
+    test_name = test["name"]
+    cell = {"app": application_name, "test": test_name, "opt_level": opt_level, "host": "local"}
+    if lease:
+        placement = {"cpus": lease["cpus"], "node": lease["node"]}
+        yield {"type": "cell_start", **cell, **placement,
+               "message": f"\nRunning {test_name} locally for {application_name} at opt level {opt_level} "
+                          f"on CPU {lease['cpus'][0]} (node {lease['node']})...\n"}
+    else:
+        yield {"type": "cell_start", **cell, "message": f"\nRunning {test_name} locally...\n"}
 
-        # Run local tests
+    test_results_dir = os.path.join(results_dir, test_name.replace('.py', '')) if results_dir else None
+    test_results, output, error = yield from run_local_script(test_name, application_name, opt_level,
+                                                              test_results_dir, test.get('args'), lease)
+
+    if error:
+        level_results[f"{test_name}_local"] = {"error": error}
+        yield {"type": "error", **cell, "message": error + "\n"}
+    else:
+        yield output + "\n"
+        level_results[f"{test_name}_local"] = test_results
+        yield {"type": "cell_result", **cell, "result": test_results}
+
+def run_compile_stage(applications, opt_levels, compile_test, results, results_dir=None, cancel_event=None):
+    # Every local and VM test runs the same binaries, so they are built once, before anything else starts
+    if len(applications) == 1:
         for opt_level in opt_levels:
-            level_key = f"optimization_level_{opt_level}"
-            if level_key not in results:
-                results[level_key] = {}
-            yield f"\nOptimization Level: {opt_level}\n"
-            for test in local_tests:
-                test_name = test["name"]
-                yield f"\nRunning {test_name} locally...\n"
-
-                result, error = run_local_script(test_name, application_name, opt_level)
-
-                if error:
-                    results[level_key][f"{test_name}_local"] = {"error": error}
-                    yield error + "\n"
-                else:
-                    yield result + "\n"
-                    try:
-                        last_line = result.strip().split('\n')[-1]
-                        file_path = last_line.split()[-1]
-                        test_results = read_json_file(file_path)
-                        results[level_key][f"{test_name}_local"] = test_results
-                    except Exception as e:
-                        results[level_key][f"{test_name}_local"] = {"error": str(e)}
-
-        # Run VM tests
-        if vm_config and any(test['active'] for test in vm_tests):
-            yield f"\nRunning VM tests...\n"
+            if cancel_event and cancel_event.is_set():
+                raise JobCancelled()
+            yield from run_local_cell(applications[0], opt_level, compile_test,
+                                      results[applications[0]][f"optimization_level_{opt_level}"], results_dir)
+        return
+
+    yield {"type": "cell_start", "test": compile_test["name"], "host": "local",
+           "message": f"\nCompiling {len(applications)} applications at opt levels {opt_levels}...\n"}
+    test_results_dir = os.path.join(results_dir, 'compile') if results_dir else None
+    try:
+        compile_times, output = get_local_pool().submit(run_compile_matrix, applications, opt_levels, test_results_dir,
+                                                        compile_test.get('args')).result()
+    except Exception as e:
+        for application_name in applications:
+            for opt_level in opt_levels:
+                results[application_name][f"optimization_level_{opt_level}"][f"{compile_test['name']}_local"] = {"error": f"Error: {e}"}
+        yield {"type": "error", "test": compile_test["name"], "host": "local", "message": f"Error: {e}\n"}
+        return
+    yield output
+    for application_name in applications:
+        for opt_level in opt_levels:
+            cell_results = compile_times.get((application_name, opt_level), {})
+            results[application_name][f"optimization_level_{opt_level}"][f"{compile_test['name']}_local"] = cell_results
+            yield {"type": "cell_result", "app": application_name, "test": compile_test["name"], "opt_level": opt_level,
+                   "host": "local", "result": cell_results}
+
+def needs_whole_host(test):
+    # Quiet mode changes host-wide settings (turbo), so it cannot share the host either
+    return test["name"] in EXCLUSIVE_TESTS or bool(test.get('args', {}).get('quiet'))
+
+def run_parallel_cells(applications, opt_levels, local_tests, results, scheduler, results_dir=None,
+                       cancel_event=None):
+    """Run local cells side by side, each on a physical core leased from the scheduler."""
+    cells = [(application_name, opt_level, test) for application_name in applications for opt_level in opt_levels
+             for test in local_tests]
+    # Cells that need the whole host drain it, so they go last instead of stalling the shared cells again and again
+    cells.sort(key=lambda cell: needs_whole_host(cell[2]))
+    pending = queue.Queue()
+    for cell in cells:
+        pending.put(cell)
+    get_local_pool(len(scheduler.cores))
+    yield f"\nRunning {len(cells)} local cell(s) on {len(scheduler.cores)} physical core(s)...\n"
+
+    def worker():
+        while True:
+            if cancel_event and cancel_event.is_set():
+                raise JobCancelled()
             try:
-                for line in run_vm_tests(application_name, opt_levels, vm_tests, vm_config):
-                    yield line
-                collect_vm_results(application_name, opt_levels, vm_tests, results)
-                yield f"\nDisconnected from VM {vm_config['hostname']}...\n"
-            except Exception as e:
-                yield f"\nFailed to run VM tests: {str(e)}\n"
+                application_name, opt_level, test = pending.get_nowait()
+            except queue.Empty:
+                return
+            with scheduler.lease(exclusive=needs_whole_host(test)) as lease:
+                yield from run_local_cell(application_name, opt_level, test,
+                                          results[application_name][f"optimization_level_{opt_level}"], results_dir,
+                                          lease)
+
+    yield from run_concurrently([worker() for _ in scheduler.cores])
+
+def run_local_phase(applications, opt_levels, local_tests, results, results_dir=None, cancel_event=None,
+                    scheduler=None):
+    if scheduler:
+        yield from run_parallel_cells(applications, opt_levels, local_tests, results, scheduler, results_dir,
+                                      cancel_event)
+    else:
+        for application_name in applications:
+            if len(applications) > 1:
+                yield f"\nApplication: {application_name}\n"
+            for opt_level in opt_levels:
+                yield f"\nOptimization Level: {opt_level}\n"
+                for test in local_tests:
+                    if cancel_event and cancel_event.is_set():
+                        raise JobCancelled()
+                    yield from run_local_cell(application_name, opt_level, test,
+                                              results[application_name][f"optimization_level_{opt_level}"],
+                                              results_dir)
+
+    # Warm containers are reused across the whole local matrix and removed once it is done
+    if any(test.get('args', {}).get('warm') for test in local_tests):
+        get_local_pool().submit(shutdown_warm_containers).result()
+
+def run_vm_phase(applications, opt_levels, vm_tests, vm_config, results, results_dir=None, cancel_event=None,
+                 reserved_cores=()):
+    if reserved_cores:
+        # On Linux pid 0 is the calling thread, so this moves only the VM control plane (and the
+        # ansible processes it spawns) off the cores local measurements are pinned to
+        control_cores = os.sched_getaffinity(0) - set(reserved_cores)
+        if control_cores:
+            os.sched_setaffinity(0, control_cores)
+    if cancel_event and cancel_event.is_set():
+        raise JobCancelled()
+    yield f"\nRunning VM tests...\n"
+    local_results_path = results_dir or LOCAL_RESULTS_PATH
+    # Jobs get their own results directory on the VM as well
+    remote_results_path = f"{vm_config['results_path']}/jobs/{os.path.basename(results_dir)}" if results_dir else None
+    try:
+        # One VM session covers every application in the request
+        cell_hosts, cell_errors = yield from run_vm_tests(applications, opt_levels, vm_tests, vm_config,
+                                                          local_results_path, remote_results_path, cancel_event)
+        for application_name in applications:
+            collect_vm_results(application_name, opt_levels, vm_tests, results[application_name], local_results_path,
+                               cell_hosts, cell_errors)
+        yield f"\nDisconnected from VMs {', '.join(sorted(set(cell_hosts.values())))}...\n"
+    except Exception as e:
+        yield {"type": "error", "message": f"\nFailed to run VM tests: {str(e)}\n"}
+    if cancel_event and cancel_event.is_set():
+        raise JobCancelled()
 
-        total_time = time.time() - start_time
+def resolve_applications(data):
+    """The request's applications: "application_names" (a list or "all"), or a single "application_name"."""
+    names = data.get('application_names') or data.get('application_name')
+    if names == 'all':
+        return import_script('compile.py').load_benchmarks()
+    if isinstance(names, str):
+        return [names]
+    return list(names or [])
 
-        # Create a directory for this profiling run
+def validate_applications(data):
+    """Error message for a request whose applications are missing, empty or not PolyBench kernels, else None."""
+    names = data.get('application_names') or data.get('application_name')
+    if names == 'all':
+        return None
+    if isinstance(names, str):
+        names = [names]
+    if not isinstance(names, list) or not names:
+        return "application_name or application_names is required"
+    if not all(isinstance(name, str) and name for name in names):
+        return "application names must be non-empty strings"
+    unknown = sorted(set(names) - set(import_script('compile.py').load_benchmarks()))
+    if unknown:
+        return f"Unknown application(s): {', '.join(unknown)}"
+    return None
+
+def run_concurrently(phases):
+    """Drive each progress generator on its own thread and yield their lines as they arrive."""
+    lines = queue.Queue()
+    errors = []
+
+    def drive(phase):
+        try:
+            for line in phase:
+                lines.put(line)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=drive, args=(phase,), daemon=True) for phase in phases]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads) or not lines.empty():
+        try:
+            yield lines.get(timeout=1)
+        except queue.Empty:
+            pass
+
+    if errors:
+        # A cancellation takes precedence over whatever else went wrong
+        raise next((e for e in errors if isinstance(e, JobCancelled)), errors[0])
+
+def profile_application(data, results_dir=None, cancel_event=None):
+    """Run the local and VM test matrix for one request, yielding progress lines and returning the results."""
+    applications = resolve_applications(data)
+    # A list of applications (or "all") gives one consolidated result set keyed by application
+    batch = 'application_names' in data or data.get('application_name') == 'all'
+    opt_levels = data.get('opt_levels')
+    config_file = data.get('config_file', 'config.json')
+    
+    with open(config_file, 'r') as file:
+        config = json.load(file)
+    
+    local_tests = [t for t in config.get('local_tests', []) if t['active']]
+    vm_tests = [t for t in config.get('vm_tests', []) if t['active']]
+    vm_config = config.get('vm')
+    if not opt_levels:
+        opt_levels = config.get('optimization_levels', [0, 1, 2, 3])
+    
+    results = {application_name: {f"optimization_level_{opt_level}": {} for opt_level in opt_levels}
+               for application_name in applications}
+    start_time = time.time()
+
+    compile_test = next((test for test in local_tests if test['name'] == 'compile.py'), None)
+    if compile_test:
+        yield from run_compile_stage(applications, opt_levels, compile_test, results, results_dir, cancel_event)
+    local_tests = [test for test in local_tests if test is not compile_test]
+
+    scheduler = None
+    if config.get('parallel_local'):
+        # One measurement per physical core (the reserved ones, if any); sibling hyperthreads stay idle
+        topology = import_script('topology.py')
+        scheduler = topology.CoreScheduler(allowed_cpus=set(config.get('reserved_cores', [])))
+        if not scheduler.cores:
+            yield {"type": "error", "message": "\nNo usable cores for parallel local tests, running them one at a time\n"}
+            scheduler = None
+    if vm_config and any(test['active'] for test in vm_tests):
+        # The VM phase mostly waits on SSH, so it runs alongside the local measurements; ansible, ssh and the
+        # result transfers still load the host, so cells that need the whole of it wait until the VMs are done
+        exclusive_tests = [test for test in local_tests if needs_whole_host(test)]
+        shared_tests = [test for test in local_tests if not needs_whole_host(test)]
+        yield from run_concurrently([
+            run_local_phase(applications, opt_levels, shared_tests, results, results_dir, cancel_event, scheduler),
+            run_vm_phase(applications, opt_levels, vm_tests, vm_config, results, results_dir, cancel_event,
+                         config.get('reserved_cores', []))
+        ])
+        if exclusive_tests:
+            yield from run_local_phase(applications, opt_levels, exclusive_tests, results, results_dir, cancel_event,
+                                       scheduler)
+    else:
+        yield from run_local_phase(applications, opt_levels, local_tests, results, results_dir, cancel_event, scheduler)
+
+    total_time = time.time() - start_time
+
+    # Create a directory for this profiling run
+    if results_dir:
+        profile_dir = results_dir
+    else:
         timestamp = time.strftime("%Y%m%d_%H%M%S")
-        profile_dir = os.path.join(RESULTS_DIR, f'{application_name}_{timestamp}')
-        os.makedirs(profile_dir, exist_ok=True)
+        profile_dir = os.path.join(RESULTS_DIR, f'{"batch" if batch else applications[0]}_{timestamp}')
+    os.makedirs(profile_dir, exist_ok=True)
+
+    # Save results to a JSON file
+    results_file = os.path.join(profile_dir, f'{"batch" if batch else applications[0]}_results.json')
+    run_id = os.path.basename(profile_dir)
+    if batch:
+        json_results = {"applications": applications, "run_id": run_id, "profiling_results": results,
+                        "total_time": total_time}
+    else:
+        json_results = {"application": applications[0], "run_id": run_id, "profiling_results": results[applications[0]],
+                        "total_time": total_time}
+    with open(results_file, 'w') as json_file:
+        json.dump(json_results, json_file, indent=4)
+
+    try:
+        results_store.record_run(run_id, json_results, "job" if results_dir else "run_profiling")
+    except Exception as e:
+        yield {"type": "error", "message": f"\nFailed to record results in {results_store.RESULTS_DB}: {str(e)}\n"}
+
+    return json_results
+
+STREAM_FORMATS = {"text": "application/json", "ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+def stream_format(default="text"):
+    """Pick the progress format from ?format=, the request body's "stream" or the Accept header."""
+    requested = request.args.get('format') or (request.get_json(silent=True) or {}).get('stream')
+    if requested in STREAM_FORMATS:
+        return requested
+    accept = request.headers.get('Accept', '')
+    if 'text/event-stream' in accept:
+        return 'sse'
+    if 'application/x-ndjson' in accept:
+        return 'ndjson'
+    return default
+
+def format_event(item, fmt):
+    # Progress is a mix of plain log lines and typed event dicts; the text format shows the
+    # lines and event messages as before, the structured formats send everything as events
+    if isinstance(item, str):
+        if fmt == "text":
+            return item
+        item = {"type": "log", "message": item}
+    elif fmt == "text":
+        return item.get("message", "")
+    if fmt == "sse":
+        return f"event: {item['type']}\ndata: {json.dumps(item)}\n\n"
+    return json.dumps(item) + "\n"
+
+def format_stream(steps, fmt):
+    """Format a progress generator's items, passing its return value through."""
+    while True:
+        try:
+            item = next(steps)
+        except StopIteration as stop:
+            return stop.value
+        text = format_event(item, fmt)
+        if text:
+            yield text
+
+class ProfilingJob:
+    def __init__(self, data):
+        self.id = uuid.uuid4().hex
+        self.data = data
+        self.status = "queued"
+        self.log = []
+        self.results = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.results_dir = os.path.join(JOBS_RESULTS_DIR, self.id)
+        self.cancel_event = threading.Event()
+        self.updated = threading.Condition()
+
+    def append_log(self, line):
+        with self.updated:
+            self.log.append(line)
+            self.updated.notify_all()
 
-        # Save results to a JSON file
-        results_file = os.path.join(profile_dir, f'{application_name}_results.json')
-        json_results = {"application": application_name, "profiling_results": results, "total_time": total_time}
-        with open(results_file, 'w') as json_file:
-            json.dump(json_results, json_file, indent=4)
+    def set_status(self, status):
+        with self.updated:
+            self.status = status
+            if status in ("completed", "failed", "cancelled"):
+                self.finished_at = time.time()
+            self.updated.notify_all()
+
+    def is_finished(self):
+        return self.status in ("completed", "failed", "cancelled")
+
+    def follow(self):
+        """Yield the job's log from the start as it grows; returns the results once the job has finished."""
+        position = 0
+        while True:
+            with self.updated:
+                while position == len(self.log) and not self.is_finished():
+                    self.updated.wait(timeout=1)
+                lines = self.log[position:]
+                position += len(lines)
+                done = self.is_finished() and position == len(self.log)
+            yield from lines
+            if done:
+                return self.results
+
+    def summary(self):
+        return {
+            "job_id": self.id,
+            "application": self.data.get('application_names') or self.data.get('application_name'),
+            "status": self.status,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "results_dir": self.results_dir,
+            "log_lines": len(self.log)
+        }
+
+def run_job(job):
+    job.started_at = time.time()
+    job.set_status("running")
+    steps = profile_application(job.data, job.results_dir, job.cancel_event)
+    while True:
+        try:
+            job.append_log(next(steps))
+        except StopIteration as stop:
+            return stop.value
+
+def job_worker():
+    while True:
+        job = job_queue.get()
+        try:
+            if job.cancel_event.is_set():
+                job.set_status("cancelled")
+                continue
+            job.results = run_job(job)
+            job.set_status("completed")
+        except JobCancelled:
+            job.set_status("cancelled")
+        except Exception as e:
+            job.error = str(e)
+            job.set_status("failed")
+        finally:
+            job_queue.task_done()
+
+def start_job_workers():
+    # Started lazily so the Flask reloader's parent process does not run jobs
+    with jobs_lock:
+        while len(job_workers) < JOB_WORKERS:
+            worker = threading.Thread(target=job_worker, daemon=True)
+            worker.start()
+            job_workers.append(worker)
+
+def get_job(job_id):
+    with jobs_lock:
+        return jobs.get(job_id)
+
+def enqueue_job(data):
+    """Queue a profiling request as a job; None when the queue is full."""
+    start_job_workers()
+    job = ProfilingJob(data)
+    try:
+        job_queue.put_nowait(job)
+    except queue.Full:
+        return None
+    with jobs_lock:
+        jobs[job.id] = job
+    return job
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    data = request.json or {}
+    error = validate_applications(data)
+    if error:
+        return jsonify({"error": error}), 400
+    job = enqueue_job(data)
+    if job is None:
+        return jsonify({"error": "Job queue is full, try again later"}), 503
+    return jsonify(job.summary()), 202
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    with jobs_lock:
+        return jsonify([job.summary() for job in jobs.values()])
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.summary())
+
+@app.route('/jobs/<job_id>/log', methods=['GET'])
+def job_log(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+
+    fmt = stream_format()
+
+    def generate():
+        yield from format_stream(job.follow(), fmt)
+        yield format_event({"type": "job_finished", "job_id": job.id, "status": job.status,
+                            "error": job.error, "message": f"\nJob {job.id} {job.status}\n"}, fmt)
+
+    return Response(generate(), mimetype='text/plain' if fmt == 'text' else STREAM_FORMATS[fmt])
+
+@app.route('/jobs/<job_id>/results', methods=['GET'])
+def job_results(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if job.status != "completed":
+        return jsonify(job.summary()), 409
+    return jsonify(job.results)
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if not job.is_finished():
+        job.cancel_event.set()
+        if job.status == "queued":
+            job.set_status("cancelled")
+    return jsonify(job.summary())
+
+@app.route('/results/query', methods=['GET'])
+def query_results():
+    filters = {column: request.args.getlist(column) for column in results_store.FILTERS if request.args.getlist(column)}
+    try:
+        if 'opt_level' in filters:
+            filters['opt_level'] = [int(level) for level in filters['opt_level']]
+        group_by = [column for column in request.args.get('group_by', '').split(',') if column]
+        rows = results_store.query(filters, group_by, request.args.get('aggregate', 'avg'),
+                                   int(request.args.get('limit', 1000)))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(rows)
+
+@app.route('/results/runs', methods=['GET'])
+def list_result_runs():
+    return jsonify(results_store.list_runs(request.args.get('app'), int(request.args.get('limit', 100))))
+
+@app.route('/results/import', methods=['POST'])
+def import_result_files():
+    data = request.json or {}
+    return jsonify(results_store.import_results(data.get('results_dir', RESULTS_DIR)))
+
+@app.route('/compare', methods=['GET'])
+def compare_results():
+    baseline, candidate = request.args.get('baseline'), request.args.get('candidate')
+    if not baseline or not candidate:
+        return jsonify({"error": "baseline and candidate run IDs are required"}), 400
+    try:
+        comparison = compare.compare_runs(baseline, candidate,
+                                          float(request.args.get('threshold', compare.THRESHOLD_PCT)),
+                                          float(request.args.get('alpha', compare.ALPHA)),
+                                          request.args.getlist('metric') or None)
+    except KeyError as e:
+        return jsonify({"error": str(e.args[0])}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if request.args.get('all') != 'true':
+        comparison.pop("cells")
+    return jsonify(comparison)
+
+@app.route('/run_profiling', methods=['POST'])
+def run_profiling():
+    data = request.json or {}
+    # Checked before the stream starts, a bad name cannot fail halfway through the matrix
+    error = validate_applications(data)
+    if error:
+        return jsonify({"error": error}), 400
+    fmt = stream_format()
+    # Runs as a queued job like /jobs does, so it never shares the host, the worker pool or result files
+    # with another profiling run; the stream follows the job's log
+    job = enqueue_job(data)
+    if job is None:
+        return jsonify({"error": "Job queue is full, try again later"}), 503
+
+    @stream_with_context
+    def generate():
+        yield format_event({"type": "job_queued", "job_id": job.id, "message": f"\nQueued as job {job.id}\n"}, fmt)
+        try:
+            json_results = yield from format_stream(job.follow(), fmt)
+        except GeneratorExit:
+            # The client went away; nobody is left to read the results
+            job.cancel_event.set()
+            raise
+        if job.status != "completed":
+            yield format_event({"type": "error", "job_id": job.id,
+                                "message": f"\nJob {job.id} {job.status}: {job.error or ''}\n"}, fmt)
+            return
 
-        yield "\nFinal Results:\n"
-        yield json.dumps(json_results, indent=4)
+        if fmt == "text":
+            yield "\nFinal Results:\n"
+            yield json.dumps(json_results, indent=4)
+        else:
+            yield format_event({"type": "complete", "results": json_results}, fmt)
 
         # Indicate that the server is ready for the next command
         print("Server is running and waiting for the next command...")
 
     try:
-        response = Response(generate(), mimetype='application/json')
+        response = Response(generate(), mimetype=STREAM_FORMATS[fmt])
         return response
     except Exception as e:
         return jsonify({"error": str(e)}), 500
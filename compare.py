@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import math
+import argparse
+
+import results_store
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+import stats
+
+# Cells are aligned on these columns between the baseline and the candidate run
+CELL_COLUMNS = ["app", "opt_level", "test", "runtime", "host", "metric"]
+THRESHOLD_PCT = 5.0
+ALPHA = 0.05  # Welch p-value for means; the median test checks the (1 - ALPHA) bootstrap interval
+HIGHER_IS_BETTER = ("ipc",)  # Metrics where an increase is an improvement
+
+# Per-cell sample statistics are computed by SQLite straight from the stored sample arrays, and both runs are
+# aligned in the same statement; what is left in Python per cell is the significance test, run only on cells
+# past the threshold
+COMPARE_SQL = """
+WITH cells AS (
+    SELECT m.run_id, m.app, m.opt_level, m.test, m.runtime, m.host, m.metric, m.value, m.samples,
+           (SELECT COUNT(*) FROM json_each(m.samples)) AS n,
+           (SELECT AVG(s.value) FROM json_each(m.samples) AS s) AS mean,
+           (SELECT SUM(s.value * s.value) FROM json_each(m.samples) AS s) AS sum_sq
+    FROM measurements AS m
+    WHERE m.run_id IN (:baseline, :candidate) AND ({metric_filter})
+)
+SELECT b.app, b.opt_level, b.test, b.runtime, b.host, b.metric,
+       b.value AS baseline_value, b.samples AS baseline_samples, b.n AS baseline_n, b.mean AS baseline_mean, b.sum_sq AS baseline_sum_sq,
+       c.value AS candidate_value, c.samples AS candidate_samples, c.n AS candidate_n, c.mean AS candidate_mean, c.sum_sq AS candidate_sum_sq
+FROM cells AS b JOIN cells AS c
+  ON b.app = c.app AND b.opt_level IS c.opt_level AND b.test = c.test AND b.runtime IS c.runtime
+     AND b.host IS c.host AND b.metric = c.metric
+WHERE b.run_id = :baseline AND c.run_id = :candidate
+ORDER BY b.app, b.opt_level, b.test, b.runtime, b.host, b.metric
+"""
+
+# By default compare the median of every repeated measurement and every plain (unsampled) figure
+DEFAULT_METRIC_FILTER = "m.samples IS NULL OR m.metric = 'median' OR m.metric LIKE '%.median'"
+
+def sample_variance(n, mean, sum_sq):
+    if not n or n < 2:
+        return None
+    return max(0.0, (sum_sq - n * mean * mean) / (n - 1))
+
+def significance(row, alpha=ALPHA):
+    """(test name, p-value, difference CI, significant) for the statistic the metric holds.
+
+    Medians are tested by bootstrapping the median difference and means with Welch's t-test. Any other
+    figure of a summary (cv, stddev, min, ...) has no test here and is judged on the threshold alone."""
+    statistic = row["metric"].rsplit(".", 1)[-1]
+    if statistic == "median" and row["baseline_samples"] and row["candidate_samples"]:
+        ci = stats.bootstrap_median_difference_ci(json.loads(row["baseline_samples"]),
+                                                  json.loads(row["candidate_samples"]), confidence=1 - alpha)
+        if ci is not None:
+            return "bootstrap_median", None, ci, not ci[0] <= 0 <= ci[1]
+    elif statistic == "mean":
+        baseline_var = sample_variance(row["baseline_n"], row["baseline_mean"], row["baseline_sum_sq"])
+        candidate_var = sample_variance(row["candidate_n"], row["candidate_mean"], row["candidate_sum_sq"])
+        if baseline_var is not None and candidate_var is not None:
+            test = stats.welch_t_test(row["baseline_mean"], baseline_var, row["baseline_n"],
+                                      row["candidate_mean"], candidate_var, row["candidate_n"])
+            return "welch", test["p_value"], None, test["p_value"] < alpha
+    # Without repeated samples on both sides only the threshold can be applied
+    return None, None, None, None
+
+def compare_cell(row, threshold_pct=THRESHOLD_PCT, alpha=ALPHA):
+    baseline, candidate = row["baseline_value"], row["candidate_value"]
+    delta = candidate - baseline
+    delta_pct = delta / abs(baseline) * 100 if baseline else (0.0 if delta == 0 else math.inf)
+
+    higher_is_better = any(name in row["metric"] for name in HIGHER_IS_BETTER)
+    worse_pct = -delta_pct if higher_is_better else delta_pct
+    # Within the threshold the cell is unchanged whatever a test says, so it is not tested
+    test, p_value, difference_ci, significant = None, None, None, None
+    if abs(worse_pct) > threshold_pct:
+        test, p_value, difference_ci, significant = significance(row, alpha)
+    if worse_pct > threshold_pct and significant is not False:
+        verdict = "regression"
+    elif worse_pct < -threshold_pct and significant is not False:
+        verdict = "improvement"
+    else:
+        verdict = "unchanged"
+
+    return {
+        **{column: row[column] for column in CELL_COLUMNS},
+        "baseline": baseline,
+        "candidate": candidate,
+        "delta": delta,
+        "delta_pct": delta_pct,
+        "baseline_samples": row["baseline_n"],
+        "candidate_samples": row["candidate_n"],
+        "significance_test": test,
+        "p_value": p_value,
+        "difference_ci": difference_ci,
+        "significant": significant,
+        "verdict": verdict
+    }
+
+def compare_runs(baseline, candidate, threshold_pct=THRESHOLD_PCT, alpha=ALPHA, metrics=None,
+                 db_path=results_store.RESULTS_DB):
+    params = {"baseline": baseline, "candidate": candidate}
+    if metrics:
+        metric_filter = " OR ".join(f"m.metric = :metric{i}" for i in range(len(metrics)))
+        params.update({f"metric{i}": metric for i, metric in enumerate(metrics)})
+    else:
+        metric_filter = DEFAULT_METRIC_FILTER
+
+    with results_store.connect(db_path) as connection:
+        known = {row["run_id"] for row in connection.execute(
+            "SELECT run_id FROM runs WHERE run_id IN (?, ?)", (baseline, candidate))}
+        missing = [run_id for run_id in (baseline, candidate) if run_id not in known]
+        if missing:
+            raise KeyError(f"Unknown run(s): {', '.join(missing)}")
+        rows = connection.execute(COMPARE_SQL.format(metric_filter=metric_filter), params).fetchall()
+
+    cells = [compare_cell(row, threshold_pct, alpha) for row in rows if row["baseline_value"] is not None
+             and row["candidate_value"] is not None]
+    regressions = sorted((cell for cell in cells if cell["verdict"] == "regression"),
+                         key=lambda cell: -abs(cell["delta_pct"]))
+    return {
+        "baseline": baseline,
+        "candidate": candidate,
+        "threshold_pct": threshold_pct,
+        "alpha": alpha,
+        "compared_cells": len(cells),
+        "regressions": regressions,
+        "improvements": [cell for cell in cells if cell["verdict"] == "improvement"],
+        "cells": cells
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare two profiling runs from the results store cell by cell.')
+    parser.add_argument('baseline', type=str, help='Run ID of the baseline')
+    parser.add_argument('candidate', type=str, help='Run ID of the candidate')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD_PCT, help='Change in percent that counts as a regression')
+    parser.add_argument('--alpha', type=float, default=ALPHA, help='Significance level for the median bootstrap and the mean t-test')
+    parser.add_argument('--metrics', type=str, nargs='+', help='Only compare these metrics (default: medians and unsampled figures); '
+                        'only medians and means are tested for significance, the rest are judged on --threshold alone')
+    parser.add_argument('--db', type=str, default=results_store.RESULTS_DB, help='Path to the SQLite database')
+    parser.add_argument('--all', action='store_true', help='Print every compared cell, not just the regressions')
+    args = parser.parse_args()
+
+    comparison = compare_runs(args.baseline, args.candidate, args.threshold, args.alpha, args.metrics, args.db)
+    if not args.all:
+        comparison.pop("cells")
+    print(json.dumps(comparison, indent=4))
+    sys.exit(1 if comparison["regressions"] else 0)
@@ -24,5 +24,22 @@ curl -X POST http://localhost:5000/run_script -H "Content-Type: application/json
 
 curl -X POST http://localhost:5000/run_profiling      -H "Content-Type: application/json"      -d '{"application_name": "2mm", "opt_levels": [2,3]}'
 
+curl -X POST http://localhost:5000/jobs      -H "Content-Type: application/json"      -d '{"application_name": "2mm", "opt_levels": [2,3]}'
 
+curl http://localhost:5000/jobs
+curl http://localhost:5000/jobs/<job_id>
+curl http://localhost:5000/jobs/<job_id>/log
+curl http://localhost:5000/jobs/<job_id>/results
+curl -X POST http://localhost:5000/jobs/<job_id>/cancel
 
+curl -X POST http://localhost:5000/results/import
+curl http://localhost:5000/results/runs?app=2mm
+curl "http://localhost:5000/results/query?app=2mm&test=times&metric=median&group_by=opt_level,runtime,host&aggregate=avg"
+curl "http://localhost:5000/compare?baseline=<run_id>&candidate=<run_id>&threshold=5"
+
+curl -N -X POST http://localhost:5000/run_profiling -H "Content-Type: application/json" -H "Accept: application/x-ndjson" -d '{"application_name": "2mm", "opt_levels": [2,3]}'
+curl -N -X POST "http://localhost:5000/run_profiling?format=sse" -H "Content-Type: application/json" -d '{"application_name": "2mm", "opt_levels": [2,3]}'
+curl -N "http://localhost:5000/jobs/<job_id>/log?format=ndjson"
+
+curl -X POST http://localhost:5000/jobs -H "Content-Type: application/json" -d '{"application_names": "all", "opt_levels": [0,3]}'
+curl -X POST http://localhost:5000/jobs -H "Content-Type: application/json" -d '{"application_names": ["2mm", "gemm", "trisolv"]}'
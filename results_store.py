@@ -0,0 +1,243 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import argparse
+import contextlib
+
+# Every measurement as one row, indexed for filtering and aggregation across runs
+RESULTS_DB = "/root/profiler/results/results.db"
+RESULTS_DIR = "/root/profiler/results"
+
+RUNTIMES = {"native", "wasm", "wasmer", "wasmtime", "wavm", "iwasm"}
+TEST_DIRS = {"comp-times": "compile"}  # Result directories not named after their script
+RESULT_FILE = re.compile(r"^(?P<app>[^_]+)_(?P<opt>\d+)_(?P<test>.+)\.json$")
+RUN_FILE = re.compile(r"^(?P<app>[^_]+)_results\.json$")
+SETTINGS_KEYS = {"quiet_host"}  # How a test was run, not what it measured
+
+FILTERS = ["run_id", "host", "app", "opt_level", "test", "runtime", "metric", "source"]
+AGGREGATES = {"avg": "AVG(value)", "min": "MIN(value)", "max": "MAX(value)", "sum": "SUM(value)", "count": "COUNT(value)"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    app TEXT,
+    recorded_at REAL,
+    total_time REAL,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS measurements (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    host TEXT,
+    app TEXT NOT NULL,
+    opt_level INTEGER,
+    test TEXT NOT NULL,
+    runtime TEXT,
+    metric TEXT NOT NULL,
+    value REAL,
+    samples TEXT,
+    source TEXT,
+    recorded_at REAL
+);
+CREATE INDEX IF NOT EXISTS measurements_cell ON measurements (app, opt_level, test, runtime, metric);
+CREATE INDEX IF NOT EXISTS measurements_run ON measurements (run_id);
+CREATE INDEX IF NOT EXISTS measurements_metric ON measurements (metric, test);
+"""
+
+@contextlib.contextmanager
+def connect(db_path=RESULTS_DB):
+    """Connection that commits (or rolls back) on exit and is then closed; sqlite3's own context manager never closes."""
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    connection = sqlite3.connect(db_path, timeout=30)
+    try:
+        connection.row_factory = sqlite3.Row
+        # WAL lets queries run while a profiling run is being written
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        connection.executescript(SCHEMA)
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+def flatten_metrics(value, prefix="", samples=None):
+    """(metric, value, samples) for every number in a result, with nested keys joined by '.'."""
+    # Flags such as ru_maxrss_exact or variance_ok describe a measurement and are not compared as one
+    if isinstance(value, bool):
+        return
+    if isinstance(value, (int, float)):
+        yield prefix, float(value), samples
+    elif isinstance(value, dict):
+        # Summaries from stats.summarize carry their raw samples; keep them with every figure of the summary
+        own_samples = value.get("samples")
+        if isinstance(own_samples, list) and all(isinstance(s, (int, float)) for s in own_samples):
+            samples = json.dumps(own_samples)
+        for key, item in value.items():
+            yield from flatten_metrics(item, f"{prefix}.{key}" if prefix else key, samples)
+
+def runtime_of(key, app):
+    if key.startswith(f"{app}_"):
+        return key[len(app) + 1:]
+    if key.split("_")[0] in RUNTIMES:
+        return key
+    return None
+
+def flatten_result(result, app):
+    """(runtime, metric, value, samples) rows for one test's result, whatever shape the script wrote."""
+    if isinstance(result, list):
+        # doc_times.py: [{"binary": "trisolv_0.wasm (wasmer)", ...}, ...]
+        for item in result:
+            match = re.search(r"\((\w+)\)$", str(item.get("binary", ""))) if isinstance(item, dict) else None
+            runtime = match.group(1) if match else None
+            for metric, value, samples in flatten_metrics({k: v for k, v in item.items() if k != "binary"}):
+                yield runtime, metric, value, samples
+        return
+    if not isinstance(result, dict) or "error" in result:
+        return
+    for key, value in result.items():
+        if key in SETTINGS_KEYS:
+            continue
+        if key == "wasm" and isinstance(value, dict):
+            for runtime, runtime_value in value.items():
+                for metric, number, samples in flatten_metrics(runtime_value, "value" if not isinstance(runtime_value, dict) else ""):
+                    yield runtime, metric, number, samples
+            continue
+        runtime = runtime_of(key, app)
+        prefix = "" if runtime else key
+        if runtime and not isinstance(value, dict):
+            prefix = "value"
+        for metric, number, samples in flatten_metrics(value, prefix):
+            yield runtime, metric, number, samples
+
+def insert_rows(connection, run_id, app, opt_level, test, host, result, source, recorded_at):
+    rows = [(run_id, host, app, opt_level, test, runtime, metric, value, samples, source, recorded_at)
+            for runtime, metric, value, samples in flatten_result(result, app)]
+    connection.executemany(
+        "INSERT INTO measurements (run_id, host, app, opt_level, test, runtime, metric, value, samples, source, recorded_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    return len(rows)
+
+def add_run(connection, run_id, app, recorded_at, total_time, source):
+    # Re-recording a run replaces it rather than duplicating its rows
+    connection.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+    connection.execute("INSERT INTO runs (run_id, app, recorded_at, total_time, source) VALUES (?, ?, ?, ?, ?)",
+                       (run_id, app, recorded_at, total_time, source))
+
+def record_run(run_id, json_results, source="run_profiling", recorded_at=None, db_path=RESULTS_DB):
+    """Store the consolidated results profile_application returns, for one application or a batch."""
+    if "applications" in json_results:
+        results_by_app = json_results["profiling_results"]
+        run_app = ",".join(json_results["applications"])
+    else:
+        results_by_app = {json_results["application"]: json_results["profiling_results"]}
+        run_app = json_results["application"]
+    recorded_at = recorded_at or time.time()
+    rows = 0
+    with connect(db_path) as connection:
+        add_run(connection, run_id, run_app, recorded_at, json_results.get("total_time"), source)
+        for app, levels in results_by_app.items():
+            for level_key, level in levels.items():
+                opt_level = int(level_key.rsplit("_", 1)[1])
+                vm_hosts = level.get("vm_hosts", {})
+                for key, result in level.items():
+                    if key == "vm_hosts":
+                        continue
+                    test_name, _, location = key.rpartition("_")
+                    host = "local" if location == "local" else vm_hosts.get(test_name) or "vm"
+                    rows += insert_rows(connection, run_id, app, opt_level, test_name.replace(".py", ""), host, result,
+                                        source, recorded_at)
+    return rows
+
+def import_results(results_dir=RESULTS_DIR, db_path=RESULTS_DB):
+    """Load the JSON files written so far: consolidated run files and per-test result files."""
+    imported = {"runs": 0, "files": 0, "rows": 0}
+    for directory, _, files in os.walk(results_dir):
+        relative = os.path.relpath(directory, results_dir)
+        parts = [] if relative == "." else relative.split(os.sep)
+        for file_name in sorted(files):
+            path = os.path.join(directory, file_name)
+            run_match = RUN_FILE.match(file_name)
+            file_match = RESULT_FILE.match(file_name)
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            mtime = os.path.getmtime(path)
+
+            if run_match and isinstance(data, dict) and "profiling_results" in data:
+                imported["rows"] += record_run(os.path.basename(directory), data, f"import:{path}", mtime, db_path)
+                imported["runs"] += 1
+            elif file_match and parts and parts[0] != "jobs" and len(parts) <= 3:
+                # results/<test>/, results/vm_results/<test>/ or results/vm_results/<host>/<test>/;
+                # job directories are covered by their consolidated run file
+                test = TEST_DIRS.get(parts[-1], parts[-1])
+                host = "local" if parts[0] != "vm_results" else (parts[1] if len(parts) == 3 else "vm")
+                app, opt_level = file_match.group("app"), int(file_match.group("opt"))
+                run_id = f"file:{relative}/{file_name}"
+                with connect(db_path) as connection:
+                    add_run(connection, run_id, app, mtime, None, f"import:{path}")
+                    imported["rows"] += insert_rows(connection, run_id, app, opt_level, test, host, data,
+                                                    f"import:{path}", mtime)
+                imported["files"] += 1
+    return imported
+
+def query(filters=None, group_by=None, aggregate="avg", limit=1000, db_path=RESULTS_DB):
+    """Filter measurements by column; with group_by, aggregate value per group instead of returning rows."""
+    filters = filters or {}
+    where, params = [], []
+    for column in FILTERS:
+        value = filters.get(column)
+        if value is None:
+            continue
+        values = value if isinstance(value, list) else [value]
+        where.append(f"{column} IN ({', '.join('?' for _ in values)})")
+        params += values
+    where_sql = f" WHERE {' AND '.join(where)}" if where else ""
+
+    if group_by:
+        unknown = [column for column in group_by if column not in FILTERS]
+        if unknown or aggregate not in AGGREGATES:
+            raise ValueError(f"Cannot group by {unknown} with aggregate {aggregate}")
+        columns = ", ".join(group_by)
+        sql = (f"SELECT {columns}, {AGGREGATES[aggregate]} AS value, COUNT(*) AS n FROM measurements{where_sql} "
+               f"GROUP BY {columns} ORDER BY {columns} LIMIT ?")
+    else:
+        sql = (f"SELECT run_id, host, app, opt_level, test, runtime, metric, value, source, recorded_at "
+               f"FROM measurements{where_sql} ORDER BY recorded_at, id LIMIT ?")
+    with connect(db_path) as connection:
+        return [dict(row) for row in connection.execute(sql, params + [limit])]
+
+def list_runs(app=None, limit=100, db_path=RESULTS_DB):
+    sql = "SELECT runs.*, COUNT(measurements.id) AS measurements FROM runs LEFT JOIN measurements USING (run_id)"
+    params = []
+    if app:
+        sql += " WHERE runs.app = ?"
+        params.append(app)
+    sql += " GROUP BY runs.run_id ORDER BY runs.recorded_at DESC LIMIT ?"
+    with connect(db_path) as connection:
+        return [dict(row) for row in connection.execute(sql, params + [limit])]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Import results into the SQLite results store, or query it.')
+    parser.add_argument('--db', type=str, default=RESULTS_DB, help='Path to the SQLite database')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import_parser = subparsers.add_parser('import', help='Import the existing JSON result files')
+    import_parser.add_argument('--results-dir', type=str, default=RESULTS_DIR, help='Results directory to walk')
+    query_parser = subparsers.add_parser('query', help='Filter and aggregate measurements')
+    for column in FILTERS:
+        query_parser.add_argument(f'--{column.replace("_", "-")}', type=str, nargs='+', help=f'Filter on {column}')
+    query_parser.add_argument('--group-by', type=str, nargs='+', choices=FILTERS, help='Columns to aggregate over')
+    query_parser.add_argument('--aggregate', type=str, default='avg', choices=list(AGGREGATES), help='Aggregate function')
+    query_parser.add_argument('--limit', type=int, default=1000, help='Maximum number of rows')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        print(json.dumps(import_results(args.results_dir, args.db), indent=4))
+    else:
+        filters = {column: getattr(args, column) for column in FILTERS if getattr(args, column)}
+        if filters.get('opt_level'):
+            filters['opt_level'] = [int(level) for level in filters['opt_level']]
+        print(json.dumps(query(filters, args.group_by, args.aggregate, args.limit, args.db), indent=4))
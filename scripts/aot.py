@@ -0,0 +1,136 @@
+import os
+import time
+import json
+import hashlib
+import argparse
+import subprocess
+import functools
+
+# Ahead-of-time compiled artifacts, keyed on (wasm hash, runtime, runtime version, flags)
+COMPILED_DIR = "/root/profiler/compiled"
+AOT_CACHE_DIR = "/root/profiler/cache/aot"
+RESULTS_DIR = "/root/profiler/results/aot"
+
+RUNTIMES = ["wasmer", "wasmtime", "wavm", "iwasm"]
+
+ARTIFACT_SUFFIX = {
+    "wasmer": ".wasmu",
+    "wasmtime": ".cwasm",
+    "wavm": ".aot.wasm",
+    "iwasm": ".aot"
+}
+
+# iwasm only loads AOT files from a matching wamrc, so both versions go into the key
+VERSION_COMMANDS = {
+    "wasmer": [["wasmer", "--version"]],
+    "wasmtime": [["wasmtime", "--version"]],
+    "wavm": [["wavm", "version"]],
+    "iwasm": [["wamrc", "--version"], ["iwasm", "--version"]]
+}
+
+def compile_command(runtime, wasm_file, output_file, flags=()):
+    if runtime == "wasmtime":
+        return ["wasmtime", "compile", *flags, wasm_file, "-o", output_file]
+    if runtime == "wasmer":
+        return ["wasmer", "compile", *flags, wasm_file, "-o", output_file]
+    if runtime == "wavm":
+        return ["wavm", "compile", *flags, wasm_file, output_file]
+    if runtime == "iwasm":
+        return ["wamrc", *flags, "-o", output_file, wasm_file]
+    raise ValueError(f"Unsupported runtime {runtime}")
+
+def run_command(runtime, artifact):
+    if runtime == "wasmtime":
+        return ["wasmtime", "run", "--allow-precompiled", artifact]
+    if runtime == "wasmer":
+        return ["wasmer", "run", artifact]
+    if runtime == "wavm":
+        return ["wavm", "run", "--precompiled", artifact]
+    if runtime == "iwasm":
+        return ["iwasm", artifact]
+    raise ValueError(f"Unsupported runtime {runtime}")
+
+@functools.lru_cache(maxsize=None)
+def runtime_version(runtime):
+    outputs = []
+    for command in VERSION_COMMANDS[runtime]:
+        result = subprocess.run(command, capture_output=True, text=True)
+        outputs.append((result.stdout or result.stderr).strip())
+    return " / ".join(outputs)
+
+def artifact_key(runtime, wasm_file, flags=()):
+    digest = hashlib.sha256()
+    with open(wasm_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    digest.update("\0".join([runtime, runtime_version(runtime), *flags]).encode())
+    return digest.hexdigest()
+
+def precompile(runtime, wasm_file, flags=(), force=False):
+    os.makedirs(AOT_CACHE_DIR, exist_ok=True)
+    key = artifact_key(runtime, wasm_file, flags)
+    artifact = os.path.join(AOT_CACHE_DIR, f"{key}{ARTIFACT_SUFFIX[runtime]}")
+    metadata_file = os.path.join(AOT_CACHE_DIR, f"{key}.json")
+
+    if not force and os.path.exists(artifact) and os.path.exists(metadata_file):
+        with open(metadata_file, 'r') as f:
+            metadata = json.load(f)
+        # The compile time is the one measured when the artifact was actually built
+        return {**metadata, "artifact": artifact, "cache_hit": True}
+
+    tmp_file = f"{artifact}.{os.getpid()}.tmp"
+    command = compile_command(runtime, wasm_file, tmp_file, flags)
+    try:
+        start_time = time.perf_counter()
+        result = subprocess.run(command, capture_output=True, text=True)
+        compile_time = time.perf_counter() - start_time
+        if result.returncode != 0:
+            raise RuntimeError(f"AOT compilation with {runtime} failed for {wasm_file}: {result.stderr.strip()}")
+        os.replace(tmp_file, artifact)
+    except (OSError, RuntimeError):
+        # A failed compiler may leave a partial output behind
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+    metadata = {
+        "runtime": runtime,
+        "runtime_version": runtime_version(runtime),
+        "flags": list(flags),
+        "source": os.path.basename(wasm_file),
+        "compile_time": compile_time
+    }
+    with open(metadata_file, 'w') as f:
+        json.dump(metadata, f, indent=4)
+    print(f"{runtime} AOT Compilation Time for {os.path.basename(wasm_file)}: {compile_time}s")
+    return {**metadata, "artifact": artifact, "cache_hit": False}
+
+def main(file_name, opt_level, results_dir=RESULTS_DIR, runtimes=RUNTIMES, force=False):
+    if not os.path.exists(results_dir):
+        os.makedirs(results_dir)
+
+    wasm_file = os.path.join(COMPILED_DIR, f"{file_name}_{opt_level}.wasm")
+    results = {}
+    for runtime in runtimes:
+        try:
+            results[runtime] = precompile(runtime, wasm_file, force=force)
+        except (OSError, RuntimeError) as e:
+            print(f"Error: {e}")
+            results[runtime] = {"error": str(e)}
+
+    json_output_file = os.path.join(results_dir, f"{file_name}_{opt_level}_aot.json")
+    with open(json_output_file, 'w') as json_file:
+        json.dump(results, json_file, indent=4)
+
+    print(f"AOT compilation results saved to {json_output_file}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Ahead-of-time compile a WASM file for each runtime and record compile times.')
+    parser.add_argument('file_name', type=str, help='Name of the file to compile')
+    parser.add_argument('opt_level', type=int, choices=[0, 1, 2, 3], help='Optimization level (0, 1, 2, 3)')
+    parser.add_argument('--results-dir', type=str, default=RESULTS_DIR, help='Directory to write the results JSON to')
+    parser.add_argument('--runtimes', nargs='+', choices=RUNTIMES, default=RUNTIMES, help='Runtimes to precompile for')
+    parser.add_argument('--force', action='store_true', help='Recompile even if a cached artifact exists')
+    args = parser.parse_args()
+    main(args.file_name, args.opt_level, args.results_dir, args.runtimes, args.force)
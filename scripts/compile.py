@@ -3,6 +3,9 @@ import time
 import subprocess
 import argparse
 import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import compile_cache
 
 # Directory setup
 SOURCE_DIR = "/root/profiler/PolyBenchC/files"
@@ -12,15 +15,80 @@ CLANG_WASI_PATH = "/home/imran/bench/Clang_dir/wasi-sdk-20.0/bin/clang"
 WASI_SDK_PATH = "/home/imran/bench/Clang_dir/wasi-sdk-20.0"
 COMPILED_DIR = "/root/profiler/compiled"
 COMPILE_RESULTS_DIR = "/root/profiler/results/comp-times"
+BENCHMARK_LIST = os.path.join(UTILITIES_DIR, "benchmark_list")
+
+OPT_LEVELS = [0, 1, 2, 3]
+TARGETS = ["native", "wasm"]
+
+# Build variants that make the kernel report its own run time on stdout
+VARIANT_DEFINES = {
+    "time": ["-DPOLYBENCH_TIME"],
+    "cycles": ["-DPOLYBENCH_TIME", "-DPOLYBENCH_CYCLE_ACCURATE_TIMER"]
+}
+VARIANTS = list(VARIANT_DEFINES)
+
+# PolyBench problem sizes, smallest first; without a define polybench builds LARGE_DATASET
+DATASET_DEFINES = {
+    "mini": "-DMINI_DATASET",
+    "small": "-DSMALL_DATASET",
+    "medium": "-DMEDIUM_DATASET",
+    "large": "-DLARGE_DATASET",
+    "extralarge": "-DEXTRALARGE_DATASET"
+}
+DATASETS = list(DATASET_DEFINES)
+
+def artifact_name(filename, opt_level, target, variant=None, dataset=None):
+    base = "_".join(str(part) for part in [filename, opt_level, variant, dataset] if part is not None)
+    return f"{base}_native" if target == "native" else f"{base}.wasm"
+
+def variant_defines(variant, target, dataset=None):
+    defines = VARIANT_DEFINES[variant] if variant else []
+    if dataset:
+        defines = defines + [DATASET_DEFINES[dataset]]
+    # The cycle-accurate timer reads RDTSC through inline asm, which wasm32 cannot express
+    if target == "wasm":
+        defines = [d for d in defines if d != "-DPOLYBENCH_CYCLE_ACCURATE_TIMER"]
+    return defines
+
+def compile_time_key(filename, target, variant=None, dataset=None):
+    return "_".join(part for part in [filename, variant, dataset, target] if part)
+
+def kernel_inputs(filename):
+    source_dir = os.path.join(SOURCE_DIR, filename)
+    inputs = [os.path.join(source_dir, f"{filename}.c")]
+    header = os.path.join(source_dir, f"{filename}.h")
+    if os.path.exists(header):
+        inputs.append(header)
+    inputs += [os.path.join(UTILITIES_DIR, "polybench.c"), os.path.join(UTILITIES_DIR, "polybench.h")]
+    return inputs
+
+def run_compile(command, filename, output_file, force=False):
+    # Returns (succeeded, compile_time, stderr); compile_time is None on a cache hit
+    try:
+        key = compile_cache.cache_key(command, kernel_inputs(filename))
+    except OSError as e:
+        # A missing source fails this kernel only, like a clang error would
+        return False, None, str(e)
+    if not force and compile_cache.lookup(key, output_file):
+        return True, None, ""
+
+    start_time = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True)
+    end_time = time.perf_counter()
+
+    if result.returncode == 0:
+        compile_cache.store(key, output_file)
+    return result.returncode == 0, end_time - start_time, result.stderr
 
-def compile_native(filename, opt_level):
+def compile_native(filename, opt_level, force=False, variant=None, dataset=None):
     source_file = os.path.join(SOURCE_DIR, filename, f"{filename}.c")
-    output_file = os.path.join(COMPILED_DIR, f"{filename}_{opt_level}_native")
+    output_file = os.path.join(COMPILED_DIR, artifact_name(filename, opt_level, "native", variant, dataset))
     command = [
         CLANG_NATIVE_PATH, 
         "-I/usr/include", 
         "-I" + UTILITIES_DIR, 
         "-DPOLYBENCH", 
+        *variant_defines(variant, "native", dataset),
         f"-O{opt_level}", 
         source_file, 
         os.path.join(UTILITIES_DIR, "polybench.c"), 
@@ -29,26 +97,27 @@ def compile_native(filename, opt_level):
         "-lm"
     ]
 
-    start_time = time.perf_counter()
-    result = subprocess.run(command, capture_output=True, text=True)
-    end_time = time.perf_counter()
+    succeeded, compile_time, stderr = run_compile(command, filename, output_file, force)
 
-    if result.returncode != 0:
-        print(f"Error: Native compilation failed for {filename} with stderr: {result.stderr}")
+    if not succeeded:
+        print(f"Error: Native compilation failed for {filename} with stderr: {stderr}")
+    elif compile_time is None:
+        print(f"Native binary for {filename} reused from compile cache")
     else:
-        print(f"Native Compilation Time for {filename}: {end_time - start_time}s")
+        print(f"Native Compilation Time for {filename}: {compile_time}s")
 
-    return output_file, end_time - start_time
+    return output_file, compile_time
 
-def compile_wasm(filename, opt_level):
+def compile_wasm(filename, opt_level, force=False, variant=None, dataset=None):
     source_file = os.path.join(SOURCE_DIR, filename, f"{filename}.c")
-    output_file = os.path.join(COMPILED_DIR, f"{filename}_{opt_level}.wasm")
+    output_file = os.path.join(COMPILED_DIR, artifact_name(filename, opt_level, "wasm", variant, dataset))
     command = [
         CLANG_WASI_PATH,
         "--target=wasm32-unknown-wasi",
         f"--sysroot={WASI_SDK_PATH}/share/wasi-sysroot",
         f"-I{UTILITIES_DIR}",
         "-DPOLYBENCH",
+        *variant_defines(variant, "wasm", dataset),
         "-D_WASI_EMULATED_PROCESS_CLOCKS",
         f"-O{opt_level}",
         source_file,
@@ -58,41 +127,127 @@ def compile_wasm(filename, opt_level):
         "-lwasi-emulated-process-clocks",
     ]
 
-    start_time = time.perf_counter()
-    result = subprocess.run(command, capture_output=True, text=True)
-    end_time = time.perf_counter()
+    succeeded, compile_time, stderr = run_compile(command, filename, output_file, force)
 
-    if result.returncode != 0:
-        print(f"Error during WASM compilation for {filename}: {result.stderr}")
+    if not succeeded:
+        print(f"Error during WASM compilation for {filename}: {stderr}")
+    elif compile_time is None:
+        print(f"WASM module for {filename} reused from compile cache")
+    else:
+        print(f"WASM Compilation Time for {filename}: {compile_time}s")
+
+    return output_file, compile_time
+
+def load_benchmarks(benchmark_list=BENCHMARK_LIST):
+    # Entries look like ./linear-algebra/kernels/2mm/2mm.c; SOURCE_DIR is keyed by kernel name
+    benchmarks = []
+    with open(benchmark_list, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                benchmarks.append(os.path.splitext(os.path.basename(line))[0])
+    return benchmarks
+
+def compile_target(filename, opt_level, target, force=False, variant=None, dataset=None):
+    if target == "native":
+        output_file, compile_time = compile_native(filename, opt_level, force, variant, dataset)
+    elif target == "wasm":
+        output_file, compile_time = compile_wasm(filename, opt_level, force, variant, dataset)
     else:
-        print(f"WASM Compilation Time for {filename}: {end_time - start_time}s")
+        raise ValueError(f"Unsupported target {target}")
+    return filename, opt_level, target, output_file, compile_time
+
+def save_compile_times(filename, opt_level, compile_times, results_dir=COMPILE_RESULTS_DIR):
+    json_output_file = os.path.join(results_dir, f"{filename}_{opt_level}_com-times.json")
+    # Keep entries of targets that were not rebuilt in this run
+    if os.path.exists(json_output_file):
+        with open(json_output_file, 'r') as json_file:
+            compile_times = {**json.load(json_file), **compile_times}
+    with open(json_output_file, 'w') as json_file:
+        json.dump(compile_times, json_file, indent=4)
+    return json_output_file
+
+def build_matrix(benchmarks, opt_levels=OPT_LEVELS, targets=TARGETS, jobs=None, measure_times=False, force=False,
+                 results_dir=COMPILE_RESULTS_DIR, variant=None, dataset=None):
+    os.makedirs(COMPILED_DIR, exist_ok=True)
+    os.makedirs(results_dir, exist_ok=True)
 
-    return output_file, end_time - start_time
+    # Concurrent clang jobs skew each other's wall time, so measure one at a time
+    if measure_times:
+        jobs = 1
+        force = True
+    elif not jobs:
+        jobs = os.cpu_count() or 1
 
-def main(filename, opt_level):
+    cells = [(b, o, t) for b in benchmarks for o in opt_levels for t in targets]
+    print(f"Compiling {len(cells)} targets with {jobs} parallel job(s)")
+
+    compile_times = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(compile_target, *cell, force, variant, dataset) for cell in cells]
+        for future in as_completed(futures):
+            filename, opt_level, target, _, compile_time = future.result()
+            # Cache hits carry no compile time, so they never overwrite a measured one
+            if compile_time is not None:
+                compile_times.setdefault((filename, opt_level), {})[compile_time_key(filename, target, variant, dataset)] = compile_time
+
+    for (filename, opt_level), times in compile_times.items():
+        times["jobs"] = jobs
+        # Times taken under contention would merge over clean single-job entries, so they are not saved
+        if jobs > 1:
+            continue
+        json_output_file = save_compile_times(filename, opt_level, times, results_dir)
+        print(f"Compilation times saved to {json_output_file}")
+    if jobs > 1 and compile_times:
+        print(f"Compile times from {jobs} parallel jobs are skewed and were not saved; use --measure-times to record them")
+
+    return compile_times
+
+def main(filename, opt_level, force=False, results_dir=COMPILE_RESULTS_DIR, variant=None, dataset=None,
+         measure_times=False):
+    # Cache hits are reused unless a compile time is to be measured, which needs a real compile
+    force = force or measure_times
     if not os.path.exists(COMPILED_DIR):
         os.makedirs(COMPILED_DIR)
-    if not os.path.exists(COMPILE_RESULTS_DIR):
-        os.makedirs(COMPILE_RESULTS_DIR)
+    if not os.path.exists(results_dir):
+        os.makedirs(results_dir)
 
     compile_times = {}
 
-    native_file, native_compile_time = compile_native(filename, opt_level)
-    compile_times[f"{filename}_native"] = native_compile_time
+    native_file, native_compile_time = compile_native(filename, opt_level, force, variant, dataset)
+    if native_compile_time is not None:
+        compile_times[compile_time_key(filename, "native", variant, dataset)] = native_compile_time
 
-    wasm_file, wasm_compile_time = compile_wasm(filename, opt_level)
-    compile_times[f"{filename}_wasm"] = wasm_compile_time
+    wasm_file, wasm_compile_time = compile_wasm(filename, opt_level, force, variant, dataset)
+    if wasm_compile_time is not None:
+        compile_times[compile_time_key(filename, "wasm", variant, dataset)] = wasm_compile_time
 
-    json_output_file = os.path.join(COMPILE_RESULTS_DIR, f"{filename}_{opt_level}_com-times.json")
-    with open(json_output_file, 'w') as json_file:
-        json.dump(compile_times, json_file, indent=4)
+    json_output_file = save_compile_times(filename, opt_level, compile_times, results_dir)
 
     print(f"Compilation times saved to {json_output_file}")
+    return compile_times
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Compile and measure compilation times of a WASM file and a native binary.')
-    parser.add_argument('filename', type=str, help='Name of the file to compile')
-    parser.add_argument('opt_level', type=int, choices=[0, 1, 2, 3], help='Optimization level (0, 1, 2, 3)')
+    parser.add_argument('filename', type=str, nargs='?', help='Name of the file to compile')
+    parser.add_argument('opt_level', type=int, nargs='?', choices=[0, 1, 2, 3], help='Optimization level (0, 1, 2, 3)')
+    parser.add_argument('--matrix', action='store_true', help='Build the full benchmark x opt level x target matrix')
+    parser.add_argument('--benchmarks', nargs='+', help='Benchmarks to build in matrix mode (default: all in benchmark_list)')
+    parser.add_argument('--opt-levels', type=int, nargs='+', choices=OPT_LEVELS, default=OPT_LEVELS, help='Optimization levels to build in matrix mode')
+    parser.add_argument('--targets', nargs='+', choices=TARGETS, default=TARGETS, help='Targets to build in matrix mode')
+    parser.add_argument('--jobs', type=int, help='Parallel compile jobs in matrix mode (default: number of cores)')
+    parser.add_argument('--measure-times', action='store_true', help='Compile everything, one at a time, so compile times are recorded unskewed')
+    parser.add_argument('--force', action='store_true', help='Bypass the compile cache')
+    parser.add_argument('--results-dir', type=str, default=COMPILE_RESULTS_DIR, help='Directory to write compile times to')
+    parser.add_argument('--variant', choices=VARIANTS, help='Build with -DPOLYBENCH_TIME (time) or the cycle-accurate timer (cycles, native only)')
+    parser.add_argument('--dataset', choices=DATASETS, help='PolyBench problem size to build (default: the LARGE_DATASET polybench picks)')
     args = parser.parse_args()
-    main(args.filename, args.opt_level)
 
+    if args.matrix:
+        build_matrix(args.benchmarks or load_benchmarks(), args.opt_levels, args.targets, args.jobs, args.measure_times, args.force,
+                     args.results_dir, args.variant, args.dataset)
+    elif args.filename is None or args.opt_level is None:
+        parser.error('filename and opt_level are required unless --matrix is given')
+    else:
+        main(args.filename, args.opt_level, force=args.force, results_dir=args.results_dir, variant=args.variant,
+             dataset=args.dataset, measure_times=args.measure_times)
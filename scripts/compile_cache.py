@@ -0,0 +1,63 @@
+import os
+import shutil
+import hashlib
+import subprocess
+import functools
+
+# Content-addressed store for compiled artifacts
+CACHE_DIR = "/root/profiler/cache/compile"
+CACHE_MAX_BYTES = 2 * 1024 ** 3  # Evict least recently used artifacts above 2 GiB
+
+@functools.lru_cache(maxsize=None)
+def compiler_version(compiler):
+    result = subprocess.run([compiler, "--version"], capture_output=True, text=True)
+    return result.stdout.strip()
+
+def cache_key(command, input_files):
+    digest = hashlib.sha256()
+    digest.update(compiler_version(command[0]).encode())
+    digest.update("\0".join(command).encode())
+    for path in input_files:
+        digest.update(path.encode())
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def lookup(key, output_file):
+    artifact = os.path.join(CACHE_DIR, key)
+    if not os.path.isfile(artifact):
+        return False
+    shutil.copy2(artifact, output_file)
+    os.utime(artifact)  # Mark as recently used for LRU eviction
+    return True
+
+def store(key, output_file, max_bytes=CACHE_MAX_BYTES):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    artifact = os.path.join(CACHE_DIR, key)
+    tmp_file = f"{artifact}.{os.getpid()}.tmp"
+    shutil.copy2(output_file, tmp_file)
+    os.replace(tmp_file, artifact)  # Atomic so parallel compiles never see a partial artifact
+    os.utime(artifact)
+    evict(max_bytes)
+
+def evict(max_bytes=CACHE_MAX_BYTES):
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        if name.endswith(".tmp"):
+            continue
+        try:
+            stat = os.stat(os.path.join(CACHE_DIR, name))
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total_size <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(CACHE_DIR, name))
+        except FileNotFoundError:
+            pass
+        total_size -= size
@@ -0,0 +1,52 @@
+import subprocess
+import hashlib
+import argparse
+
+import topology
+
+# Long-lived containers, one per (image, docker run options), reused through docker exec
+CONTAINER_PREFIX = "profiler-warm"
+SOURCE_DIR = "/root/profiler/compiled"
+
+def container_name(image, run_args=()):
+    key = "\0".join([image, *run_args])
+    return f"{CONTAINER_PREFIX}-{hashlib.sha1(key.encode()).hexdigest()[:12]}"
+
+def is_running(name):
+    result = subprocess.run(["docker", "inspect", "-f", "{{.State.Running}}", name], capture_output=True, text=True)
+    return result.returncode == 0 and result.stdout.strip() == "true"
+
+def ensure_container(image, source_dir=SOURCE_DIR, run_args=()):
+    # Containers are found by name, so separate script invocations share the same pool
+    name = container_name(image, run_args)
+    if not is_running(name):
+        subprocess.run(["docker", "rm", "-f", name], capture_output=True)
+        subprocess.run(["docker", "run", "-d", "--name", name, *run_args, "-v", f"{source_dir}:/app", "-w", "/app",
+                        image, "sleep", "infinity"], capture_output=True, check=True)
+        print(f"Started warm container {name} for {image}")
+    return name
+
+def docker_command(image, shell_command, source_dir=SOURCE_DIR, warm=False, run_args=()):
+    # A measurement pinned by the scheduler keeps its container on the same core and memory node
+    if not any(arg.startswith("--cpuset-cpus") for arg in run_args):
+        run_args = [*run_args, *topology.container_args()]
+    if warm:
+        name = ensure_container(image, source_dir, run_args)
+        return ["docker", "exec", name, "/bin/bash", "-c", shell_command]
+    return ["docker", "run", "--rm", *run_args, "-v", f"{source_dir}:/app", image, "/bin/bash", "-c", shell_command]
+
+def shutdown():
+    result = subprocess.run(["docker", "ps", "-aq", "--filter", f"name={CONTAINER_PREFIX}-"],
+                            capture_output=True, text=True)
+    container_ids = result.stdout.split()
+    if container_ids:
+        subprocess.run(["docker", "rm", "-f", *container_ids], capture_output=True)
+        print(f"Removed {len(container_ids)} warm container(s)")
+    return len(container_ids)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the warm container pool used by the doc_* scripts.")
+    parser.add_argument("action", choices=["shutdown"], help="Action to perform")
+    args = parser.parse_args()
+    if args.action == "shutdown":
+        shutdown()
@@ -1,11 +1,14 @@
 import subprocess
-import time
 import os
-import sys
+import argparse
 import json
 
+import container_pool
+import rapl_reader
+import topology
+
 # Constants
-RAPL_PATH = "/sys/class/powercap/intel-rapl/intel-rapl:0/energy_uj"
+RAPL_ROOT = rapl_reader.POWERCAP_ROOT
 ITERATIONS = 2
 SOURCE_DIR = "/root/profiler/compiled"
 RESULTS_DIR = "/root/profiler/results/doc_rapl"
@@ -17,39 +20,40 @@ DOCKER_IMAGE_MAP = {
     "clang_wasi": "bathork1391/clang-wasi:clang_with_wasi"  # Updated image for native files
 }
 
-def read_energy():
-    with open(RAPL_PATH, 'r') as f:
-        return int(f.read().strip())
-
-def execute_command(image, command, cpu_core='0'):
-    start_energy = read_energy()
-    start_time = time.time()
+def execute_command(image, command, cpu_core=None, warm=False, rapl_root=RAPL_ROOT):
+    # Start the warm container before the energy window opens
+    cpu_core = cpu_core if cpu_core is not None else topology.measured_cpus()[0]
+    docker_command = container_pool.docker_command(image, command, SOURCE_DIR, warm, [f"--cpuset-cpus={cpu_core}"])
+    sampler = rapl_reader.RaplSampler(rapl_root).start()
     # Execute the command in a Docker container with CPU affinity
-    docker_command = f"docker run --rm --cpuset-cpus=\"{cpu_core}\" -v {SOURCE_DIR}:/app {image} /bin/bash -c \"{command}\""
-    subprocess.run(docker_command, shell=True, check=True)
-    end_time = time.time()
-    end_energy = read_energy()
-    energy_used = end_energy - start_energy  # Energy in microjoules
-    time_taken = end_time - start_time  # Time in seconds
+    subprocess.run(docker_command, check=True)
+    domain_energy = sampler.stop()
+    energy_used = rapl_reader.package_total(domain_energy)  # Energy in microjoules, summed over sockets
+    time_taken = sampler.elapsed  # Time in seconds
     power_used = (energy_used / 1e6) / time_taken  # Energy in Joules, Power in Watts
-    return energy_used, power_used
+    return energy_used, power_used, domain_energy, sampler.series
 
 def average_measurements(measurements):
     average_energy = sum([m[0] for m in measurements]) / len(measurements)
     average_power = sum([m[1] for m in measurements]) / len(measurements)
     return average_energy, average_power
 
-def run_native(file_name, opt_level):
+def average_domains(measurements):
+    return {domain: sum(m[2][domain] for m in measurements) / len(measurements) for domain in measurements[0][2]}
+
+def run_native(file_name, opt_level, warm=False, rapl_root=RAPL_ROOT):
     native_file = f"{file_name}_{opt_level}_native"
     measurements = []
     for _ in range(ITERATIONS):
         command = f"./{native_file}"
-        measurements.append(execute_command(DOCKER_IMAGE_MAP['clang_wasi'], command))
+        measurements.append(execute_command(DOCKER_IMAGE_MAP['clang_wasi'], command, warm=warm, rapl_root=rapl_root))
     average_energy, average_power = average_measurements(measurements)
     print(f"{native_file}: Average Energy (uJ): {average_energy}, Average Power (W): {average_power}")
-    return {"average_energy_uJ": average_energy, "average_power_W": average_power}
+    return {"average_energy_uJ": average_energy, "average_power_W": average_power,
+            "average_domain_energy_uJ": average_domains(measurements), "energy_series": [m[3] for m in measurements],
+            "mode": "warm" if warm else "cold"}
 
-def run_wasm(file_name, opt_level):
+def run_wasm(file_name, opt_level, warm=False, rapl_root=RAPL_ROOT):
     wasm_file = f"{file_name}_{opt_level}.wasm"
     results = {}
     for runtime in DOCKER_IMAGE_MAP.keys():
@@ -61,34 +65,48 @@ def run_wasm(file_name, opt_level):
                 command = f"wavm run /app/{wasm_file}"
             else:
                 command = f"{runtime} /app/{wasm_file}"
-            measurements.append(execute_command(DOCKER_IMAGE_MAP[runtime], command))
+            measurements.append(execute_command(DOCKER_IMAGE_MAP[runtime], command, warm=warm, rapl_root=rapl_root))
         average_energy, average_power = average_measurements(measurements)
         print(f"{runtime}_{wasm_file}: Average Energy (uJ): {average_energy}, Average Power (W): {average_power}")
-        results[runtime] = {"average_energy_uJ": average_energy, "average_power_W": average_power}
+        results[runtime] = {"average_energy_uJ": average_energy, "average_power_W": average_power,
+                            "average_domain_energy_uJ": average_domains(measurements),
+                            "energy_series": [m[3] for m in measurements], "mode": "warm" if warm else "cold"}
     return results
 
-def main(file_name, opt_level):
-    if not os.path.exists(RESULTS_DIR):
-        os.makedirs(RESULTS_DIR)
+def main(file_name, opt_level, results_dir=RESULTS_DIR, warm=False, rapl_root=None):
+    # Passed down rather than set on the module, which stays loaded in a long-lived pool worker
+    rapl_root = rapl_root or RAPL_ROOT
 
-    results = {
-        "native": run_native(file_name, opt_level),
-        "wasm": run_wasm(file_name, opt_level)
-    }
+    if not os.path.exists(results_dir):
+        os.makedirs(results_dir)
 
-    json_output_file = os.path.join(RESULTS_DIR, f"{file_name}_{opt_level}_doc_rapl.json")
+    try:
+        rapl_reader.discover_domains(rapl_root)
+    except rapl_reader.RaplUnavailable as e:
+        # Without package counters every reading would be 0 uJ, which must not pass for a measurement
+        print(f"Error: {e}")
+        results = {"error": str(e)}
+    else:
+        results = {
+            "native": run_native(file_name, opt_level, warm, rapl_root),
+            "wasm": run_wasm(file_name, opt_level, warm, rapl_root)
+        }
+
+    json_output_file = os.path.join(results_dir, f"{file_name}_{opt_level}_doc_rapl.json")
     with open(json_output_file, 'w') as json_file:
         json.dump(results, json_file, indent=4)
     
     print(f"RAPL results saved to {json_output_file}")
+    return results
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python3 script.py <file_name> <opt_level>")
-        sys.exit(1)
-
-    file_name = sys.argv[1]
-    opt_level = sys.argv[2]
+    parser = argparse.ArgumentParser()
+    parser.add_argument('file_name', type=str, help='Name of the file to run')
+    parser.add_argument('opt_level', type=int, help='Optimization level of the file')
+    parser.add_argument('--results-dir', type=str, default=RESULTS_DIR, help='Directory to write the results JSON to')
+    parser.add_argument('--warm', action='store_true', help='Run in long-lived containers via docker exec')
+    parser.add_argument('--rapl-root', type=str, default=RAPL_ROOT, help='powercap sysfs root, e.g. a fake tree for testing')
+    args = parser.parse_args()
 
-    main(file_name, opt_level)
+    main(args.file_name, args.opt_level, args.results_dir, args.warm, args.rapl_root)
 
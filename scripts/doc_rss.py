@@ -4,6 +4,9 @@ import os
 import time
 import json
 
+import container_pool
+import topology
+
 # Docker images for WASM runtimes
 DOCKER_IMAGE_MAP = {
     "wasmer": "bathork1391/wasmer-runtime:from-scratch",
@@ -17,8 +20,133 @@ NATIVE_IMAGE = "bathork1391/clang-wasi:clang_with_wasi"
 SOURCE_DIR = "/root/profiler/compiled"
 RESULTS_DIR = "/root/profiler/results/doc_rss"
 INTERVAL = 0.05  # RSS monitoring interval in seconds
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+def cgroup_v2_available():
+    return os.path.exists(os.path.join(CGROUP_ROOT, "cgroup.controllers"))
+
+def find_container_cgroup(container_id):
+    # Resolve through the container's init process so both the systemd and cgroupfs drivers work
+    pid = subprocess.run(["docker", "inspect", "-f", "{{.State.Pid}}", container_id],
+                         capture_output=True, text=True, check=True).stdout.strip()
+    with open(f"/proc/{pid}/cgroup", 'r') as f:
+        for line in f:
+            if line.startswith("0::"):
+                return os.path.join(CGROUP_ROOT, line.strip()[3:].lstrip('/'))
+    return None
+
+def read_cgroup_value(cgroup_dir, name):
+    with open(os.path.join(cgroup_dir, name), 'r') as f:
+        return int(f.read().strip())
+
+def read_memory_stat(cgroup_dir):
+    stat = {}
+    with open(os.path.join(cgroup_dir, "memory.stat"), 'r') as f:
+        for line in f:
+            key, value = line.split()
+            stat[key] = int(value)
+    return stat
+
+def open_peak_counter(cgroup_dir):
+    # Writing to memory.peak resets the peak seen through this descriptor (Linux 6.12+)
+    try:
+        fd = os.open(os.path.join(cgroup_dir, "memory.peak"), os.O_RDWR)
+    except OSError:
+        return None
+    try:
+        os.write(fd, b"reset")
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+def read_peak_counter(fd):
+    os.lseek(fd, 0, os.SEEK_SET)
+    return int(os.read(fd, 64).decode().strip())
+
+def run_and_monitor_cgroup(image, run_command, file_desc, source_dir, interval, warm=False):
+    # The workload is exec'd into an idle container so the host can read the
+    # cgroup's memory.peak before the container (and its cgroup) is removed
+    # A measurement pinned by the scheduler keeps its container on the same core and memory node
+    run_args = topology.container_args()
+    if warm:
+        container_id = container_pool.ensure_container(image, source_dir, run_args)
+    else:
+        container_id = subprocess.run(
+            ["docker", "run", "-d", *run_args, "-v", f"{source_dir}:/app", "-w", "/app", image, "sleep", "infinity"],
+            capture_output=True, text=True, check=True).stdout.strip()
+    peak_fd = None
+    try:
+        cgroup_dir = find_container_cgroup(container_id)
+        baseline = read_cgroup_value(cgroup_dir, "memory.current")
+        # A warm container's lifetime peak includes earlier runs, so it needs a per-run reset
+        if warm:
+            peak_fd = open_peak_counter(cgroup_dir)
+
+        samples = []
+        start_time = time.time()
+        process = subprocess.Popen(["docker", "exec", container_id, "/bin/bash", "-c", run_command],
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        while process.poll() is None:
+            samples.append(read_cgroup_value(cgroup_dir, "memory.current"))
+            time.sleep(interval)
+        end_time = time.time()
+        stderr = process.stderr.read()
+
+        if peak_fd is not None:
+            peak = read_peak_counter(peak_fd)
+        elif warm:
+            peak = max(samples + [baseline])
+        else:
+            try:
+                peak = read_cgroup_value(cgroup_dir, "memory.peak")
+            except FileNotFoundError:
+                # memory.peak needs Linux 5.19+, older kernels only get the sampled maximum
+                peak = max(samples + [baseline])
+        memory_stat = read_memory_stat(cgroup_dir)
+    finally:
+        if peak_fd is not None:
+            os.close(peak_fd)
+        if not warm:
+            subprocess.run(["docker", "rm", "-f", container_id], capture_output=True)
+
+    if process.returncode != 0:
+        print(f"Error executing the container with file {file_desc}")
+        print(stderr.strip())
+        return
+
+    # Report the workload's share above the idle container, in KB like the other RSS results
+    rss_values = [max(sample - baseline, 0) / 1024 for sample in samples]
+    total_time = end_time - start_time
+    max_rss = max(peak - baseline, 0) / 1024
+    sum_rss = sum(rss_values)
+    avg_rss = sum_rss / len(rss_values) if rss_values else 0
+
+    print(f"Intermediate results for file: {file_desc}")
+    print(f"Maximum memory (cgroup memory.peak above baseline): {max_rss} KB")
+    print(f"Average memory: {avg_rss} KB over {len(rss_values)} samples")
+    print(f"Total execution time: {total_time:.2f} seconds")
+    print("\n")
+
+    return {
+        "sum_rss": sum_rss,
+        "avg_rss": avg_rss,
+        "max_rss": max_rss,
+        "total_time": total_time,
+        "rss_rate": sum_rss / total_time if total_time > 0 else 0,
+        "avg_rss_rate": avg_rss / total_time if total_time > 0 else 0,
+        "source": "cgroup",
+        "mode": "warm" if warm else "cold",
+        "baseline_kb": baseline / 1024,
+        "memory_peak_kb": peak / 1024,
+        "samples": len(rss_values),
+        "memory_stat": memory_stat
+    }
+
+def run_and_monitor_native(file_path, source_dir, image, interval, warm=False):
+    if cgroup_v2_available():
+        return run_and_monitor_cgroup(image, f"./{file_path}", file_path, source_dir, interval, warm)
 
-def run_and_monitor_native(file_path, source_dir, image, interval):
     monitor_command = f"""
     start_time=$(date +%s.%N)
     ./{file_path} &
@@ -36,10 +164,13 @@ def run_and_monitor_native(file_path, source_dir, image, interval):
     echo "end_time:$end_time"
     """
 
-    command = [
-        "docker", "run", "--rm", "-v", f"{source_dir}:/app", "-w", "/app",
-        image, "/bin/bash", "-c", monitor_command
-    ]
+    if warm:
+        command = container_pool.docker_command(image, monitor_command, source_dir, warm=True)
+    else:
+        command = [
+            "docker", "run", "--rm", "-v", f"{source_dir}:/app", "-w", "/app",
+            image, "/bin/bash", "-c", monitor_command
+        ]
 
     process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
     stdout, stderr = process.communicate()
@@ -49,10 +180,15 @@ def run_and_monitor_native(file_path, source_dir, image, interval):
         print(stderr.strip())
         return
 
-    return parse_results(stdout, file_path)
+    return parse_results(stdout, file_path, warm)
 
-def run_and_monitor_wasm(runtime, wasm_file, source_dir, interval):
+def run_and_monitor_wasm(runtime, wasm_file, source_dir, interval, warm=False):
     wasm_run_command = f"{runtime} /app/{wasm_file}" if runtime != "wavm" else f"wavm run /app/{wasm_file}"
+    if cgroup_v2_available():
+        return run_and_monitor_cgroup(DOCKER_IMAGE_MAP[runtime], wasm_run_command, f"{runtime} {wasm_file}",
+                                      source_dir, interval, warm)
+
+    # cgroup v1 hosts fall back to sampling VmRSS from inside the container
 
     monitor_command = f"""
     start_time=$(date +%s.%N)
@@ -71,10 +207,7 @@ def run_and_monitor_wasm(runtime, wasm_file, source_dir, interval):
     echo "end_time:$end_time"
     """
 
-    command = [
-        "docker", "run", "--rm", "-v", f"{source_dir}:/app", DOCKER_IMAGE_MAP[runtime],
-        "/bin/bash", "-c", monitor_command
-    ]
+    command = container_pool.docker_command(DOCKER_IMAGE_MAP[runtime], monitor_command, source_dir, warm)
 
     process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
     stdout, stderr = process.communicate()
@@ -84,9 +217,9 @@ def run_and_monitor_wasm(runtime, wasm_file, source_dir, interval):
         print(stderr.strip())
         return
 
-    return parse_results(stdout, f"{runtime} {wasm_file}")
+    return parse_results(stdout, f"{runtime} {wasm_file}", warm)
 
-def parse_results(stdout, file_desc):
+def parse_results(stdout, file_desc, warm=False):
     lines = stdout.strip().split('\n')
     start_time = end_time = None
     rss_values = []
@@ -124,35 +257,40 @@ def parse_results(stdout, file_desc):
         "max_rss": max_rss,
         "total_time": total_time,
         "rss_rate": rss_rate,
-        "avg_rss_rate": avg_rss / total_time if total_time > 0 else 0
+        "avg_rss_rate": avg_rss / total_time if total_time > 0 else 0,
+        "source": "in-container",
+        "mode": "warm" if warm else "cold"
     }
 
-def main(file_name, opt_level):
-    if not os.path.exists(RESULTS_DIR):
-        os.makedirs(RESULTS_DIR)
+def main(file_name, opt_level, results_dir=RESULTS_DIR, warm=False):
+    if not os.path.exists(results_dir):
+        os.makedirs(results_dir)
 
     native_file = f"{file_name}_{opt_level}_native"
     wasm_file = f"{file_name}_{opt_level}.wasm"
     
     results = {
-        "native": run_and_monitor_native(native_file, SOURCE_DIR, NATIVE_IMAGE, INTERVAL),
+        "native": run_and_monitor_native(native_file, SOURCE_DIR, NATIVE_IMAGE, INTERVAL, warm),
         "wasm": {}
     }
 
     for runtime in DOCKER_IMAGE_MAP.keys():
-        results["wasm"][runtime] = run_and_monitor_wasm(runtime, wasm_file, SOURCE_DIR, INTERVAL)
+        results["wasm"][runtime] = run_and_monitor_wasm(runtime, wasm_file, SOURCE_DIR, INTERVAL, warm)
     
-    json_output_file = os.path.join(RESULTS_DIR, f"{file_name}_{opt_level}_doc_rss.json")
+    json_output_file = os.path.join(results_dir, f"{file_name}_{opt_level}_doc_rss.json")
     with open(json_output_file, 'w') as json_file:
         json.dump(results, json_file, indent=4)
     
     print(f"RSS results saved to {json_output_file}")
+    return results
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('file_name', type=str, help='Name of the file to run')
     parser.add_argument('opt_level', type=int, help='Optimization level of the file')
+    parser.add_argument('--results-dir', type=str, default=RESULTS_DIR, help='Directory to write the results JSON to')
+    parser.add_argument('--warm', action='store_true', help='Run in long-lived containers via docker exec')
     args = parser.parse_args()
 
-    main(args.file_name, args.opt_level)
+    main(args.file_name, args.opt_level, args.results_dir, args.warm)
 
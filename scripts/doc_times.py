@@ -3,9 +3,16 @@ import argparse
 import os
 import time
 import json
+import uuid
+from urllib.parse import quote
+
+import container_pool
+import docker_api
+import topology
 
 SOURCE_DIR = "/root/profiler/compiled"
 RESULTS_DIR = "/root/profiler/results/doc_times"
+WORKLOAD_TIMEOUT = 3600  # Seconds to wait for a cold container to run and be removed
 
 DOCKER_IMAGE_MAP = {
     "wasmer": "bathork1391/wasmer-runtime:from-scratch",
@@ -17,7 +24,7 @@ DOCKER_IMAGE_MAP = {
 
 def run_command(command):
     start = time.time()
-    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     stdout, stderr = process.communicate()
     end = time.time()
     return stdout.decode().strip(), stderr.decode().strip(), end - start
@@ -27,17 +34,17 @@ def convert_time_to_seconds(time_str):
     seconds = seconds.rstrip('s')
     return int(minutes) * 60 + float(seconds)
 
-def measure_execution(runtime, binary_file):
+def measure_execution(runtime, binary_file, warm=False):
     app_path = f"/app/{binary_file}"
-    cmd = f"docker run --rm -v {SOURCE_DIR}:/app {DOCKER_IMAGE_MAP[runtime]} "
     
     if runtime == "wavm":
-        cmd += f"/bin/bash -c 'time wavm run {app_path}'"
+        shell_command = f"time wavm run {app_path}"
     elif runtime in ["wasmer", "wasmtime", "iwasm"]:
-        cmd += f"/bin/bash -c 'time {runtime} {app_path}'"
+        shell_command = f"time {runtime} {app_path}"
     else:
-        cmd += f"/bin/bash -c 'time ./{binary_file}'"  # for native
+        shell_command = f"time ./{binary_file}"  # for native
 
+    cmd = container_pool.docker_command(DOCKER_IMAGE_MAP[runtime], shell_command, SOURCE_DIR, warm)
     stdout, stderr, external_time = run_command(cmd)
     internal_time = None
 
@@ -47,9 +54,73 @@ def measure_execution(runtime, binary_file):
 
     return internal_time, external_time
 
-def main(file_name, opt_level):
-    if not os.path.exists(RESULTS_DIR):
-        os.makedirs(RESULTS_DIR)
+def runtime_command(runtime, binary_file):
+    app_path = f"/app/{binary_file}"
+    if runtime == "wavm":
+        return ["wavm", "run", app_path]
+    if runtime in ["wasmer", "wasmtime", "iwasm"]:
+        return [runtime, app_path]
+    return [f"./{binary_file}"]  # for native
+
+def resolve_image(image):
+    try:
+        docker_api.request("GET", f"/images/{quote(image, safe='')}/json")
+    except docker_api.DockerAPIError as e:
+        if e.status != 404:
+            raise
+        name, _, tag = image.rpartition(":")
+        docker_api.request("POST", f"/images/create?fromImage={quote(name)}&tag={quote(tag)}")
+
+def measure_lifecycle(runtime, binary_file):
+    # The workload is the container's own command and the engine removes the container itself, so every
+    # phase boundary is an engine event the harness does not trigger with a request of its own
+    image = DOCKER_IMAGE_MAP[runtime]
+    run_label = f"profiler.run={uuid.uuid4().hex}"
+    with docker_api.EventStream({"type": ["container"], "label": [run_label]}) as events:
+        start = time.time()
+        resolve_image(image)
+        resolved = time.time()
+
+        name, value = run_label.split("=")
+        container = docker_api.request("POST", "/containers/create", {
+            "Image": image,
+            "Cmd": runtime_command(runtime, binary_file),
+            "WorkingDir": "/app",
+            "Labels": {name: value},
+            "HostConfig": {"Binds": [f"{SOURCE_DIR}:/app"], "AutoRemove": True, **topology.container_cpuset()}
+        })
+        container_id = container["Id"]
+        try:
+            docker_api.request("POST", f"/containers/{container_id}/start")
+            events.wait_for("destroy", timeout=WORKLOAD_TIMEOUT)
+        finally:
+            if events.find("destroy") is None:
+                try:
+                    docker_api.request("DELETE", f"/containers/{container_id}?force=true")
+                except docker_api.DockerAPIError:
+                    pass  # Already removed by the engine
+
+    # "start" is emitted once the container's process is running, "die" when it has exited
+    timeline = [
+        ("image_resolve", start, resolved),
+        ("container_create", resolved, events.time_of("create")),
+        ("container_start", events.time_of("create"), events.time_of("start")),
+        ("workload", events.time_of("start"), events.time_of("die")),
+        ("removal", events.time_of("die"), events.time_of("destroy"))
+    ]
+    phases = {phase: end - begin if begin is not None and end is not None else None
+              for phase, begin, end in timeline}
+    die = events.find("die")
+    exit_code = int(die["Actor"]["Attributes"].get("exitCode", -1)) if die else None
+    end = events.time_of("destroy") or time.time()
+    return phases, end - start, exit_code
+
+def main(file_name, opt_level, results_dir=RESULTS_DIR, warm=False):
+    if not os.path.exists(results_dir):
+        os.makedirs(results_dir)
+
+    # Cold runs are broken down through the engine API when its socket is reachable
+    use_engine_events = not warm and docker_api.available()
 
     results = []
     for runtime in DOCKER_IMAGE_MAP:
@@ -58,25 +129,46 @@ def main(file_name, opt_level):
             print(f"File {binary_file} does not exist in {SOURCE_DIR}")
             continue
         print(f"Running {binary_file} on {runtime}...")
-        internal_time, external_time = measure_execution(runtime, binary_file)
+        if use_engine_events:
+            phases, external_time, exit_code = measure_lifecycle(runtime, binary_file)
+            if exit_code != 0:
+                print(f"{binary_file} ({runtime}) exited with status {exit_code}")
+            results.append({
+                "binary": f"{binary_file} ({runtime})",
+                "internal_time": phases["workload"],
+                "external_time": external_time,
+                "phases": phases,
+                "exit_code": exit_code,
+                "source": "engine-events",
+                "mode": "cold"
+            })
+            print(f"{binary_file} ({runtime}): " + ", ".join(f"{phase} = {value}s" for phase, value in phases.items()))
+            continue
+
+        internal_time, external_time = measure_execution(runtime, binary_file, warm)
         results.append({
             "binary": f"{binary_file} ({runtime})",
             "internal_time": internal_time,
-            "external_time": external_time
+            "external_time": external_time,
+            "source": "shell-time",
+            "mode": "warm" if warm else "cold"
         })
         print(f"{binary_file} ({runtime}): Internal Time = {internal_time}s, External Time = {external_time}s")
 
     # Save results to JSON file
-    json_output_file = os.path.join(RESULTS_DIR, f"{file_name}_{opt_level}_doc_times.json")
+    json_output_file = os.path.join(results_dir, f"{file_name}_{opt_level}_doc_times.json")
     with open(json_output_file, 'w') as json_file:
         json.dump(results, json_file, indent=4)
 
     print(f"Execution times saved to {json_output_file}")
+    return results
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Measure runtime for native and WASM binaries.")
     parser.add_argument("file_name", type=str, help="Name of the file to execute")
     parser.add_argument("opt_level", type=int, help="Optimization level of the binaries")
+    parser.add_argument("--results-dir", type=str, default=RESULTS_DIR, help="Directory to write the results JSON to")
+    parser.add_argument("--warm", action="store_true", help="Run in long-lived containers via docker exec")
     args = parser.parse_args()
-    main(args.file_name, args.opt_level)
+    main(args.file_name, args.opt_level, args.results_dir, args.warm)
 
@@ -0,0 +1,106 @@
+import json
+import socket
+import threading
+import http.client
+from urllib.parse import quote
+
+# Minimal Docker Engine API client over the local socket
+DOCKER_SOCKET = "/var/run/docker.sock"
+
+class DockerAPIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"Docker API error {status}: {message}")
+        self.status = status
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path=DOCKER_SOCKET, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+def available(socket_path=DOCKER_SOCKET):
+    try:
+        request("GET", "/_ping", socket_path=socket_path)
+        return True
+    except (OSError, DockerAPIError):
+        return False
+
+def request(method, path, body=None, socket_path=DOCKER_SOCKET):
+    connection = UnixHTTPConnection(socket_path)
+    try:
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        response = connection.getresponse()
+        data = response.read()
+    finally:
+        connection.close()
+    if response.status >= 400:
+        raise DockerAPIError(response.status, data.decode(errors="replace").strip())
+    if data and response.getheader("Content-Type", "").startswith("application/json"):
+        return json.loads(data)
+    return data
+
+class EventStream:
+    """Collects engine events matching the given filters on a background thread."""
+
+    def __init__(self, filters, socket_path=DOCKER_SOCKET):
+        self.filters = filters
+        self.socket_path = socket_path
+        self.events = []
+        self.connection = None
+        self.ready = threading.Event()
+        self.changed = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        # Events are only delivered once the stream's response has started
+        self.ready.wait(timeout=5)
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        self.connection = UnixHTTPConnection(self.socket_path)
+        try:
+            self.connection.request("GET", f"/events?filters={quote(json.dumps(self.filters))}")
+            response = self.connection.getresponse()
+            self.ready.set()
+            for line in iter(response.readline, b""):
+                if line.strip():
+                    with self.changed:
+                        self.events.append(json.loads(line))
+                        self.changed.notify_all()
+        except (OSError, ValueError, http.client.HTTPException):
+            pass  # Raised when close() shuts the socket down
+        finally:
+            self.ready.set()
+
+    def wait_for(self, action, timeout=5):
+        with self.changed:
+            self.changed.wait_for(lambda: self.find(action) is not None, timeout=timeout)
+            return self.find(action)
+
+    def find(self, action):
+        for event in self.events:
+            if event.get("Action", "").split(":")[0] == action:
+                return event
+        return None
+
+    def time_of(self, action):
+        event = self.find(action)
+        return event["timeNano"] / 1e9 if event else None
+
+    def close(self):
+        if self.connection is not None and self.connection.sock is not None:
+            try:
+                self.connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.thread.join(timeout=5)
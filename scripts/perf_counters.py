@@ -0,0 +1,239 @@
+import os
+import re
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import aot
+import compile
+import runtimes
+import stats
+import topology
+
+# Directory setup
+COMPILED_DIR = "/root/profiler/compiled"
+RESULTS_DIR = "/root/profiler/results/perf_counters"
+COUNTERS_LIST = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utilities", "papi_counters.list")
+
+# Runtimes
+RUNTIMES = runtimes.RUNTIMES
+
+REPETITIONS = 3
+INTERVAL_MS = 10  # perf stat -I period; older perf versions refuse anything below 10 ms
+MIN_KERNEL_INTERVALS = 10  # Below this the prorated boundary interval dominates the kernel counts
+
+# Always collected, so IPC, cache, TLB and branch figures exist whatever papi_counters.list contains
+BASE_EVENTS = ["cycles", "instructions", "cache-references", "cache-misses", "L1-dcache-load-misses",
+               "dTLB-load-misses", "iTLB-load-misses", "branches", "branch-misses"]
+
+# perf equivalents of the PAPI presets (and the native events shipped in papi_counters.list)
+PAPI_TO_PERF = {
+    "PAPI_TOT_CYC": "cycles",
+    "PAPI_TOT_INS": "instructions",
+    "PAPI_L1_DCM": "L1-dcache-load-misses",
+    "PAPI_L1_ICM": "L1-icache-load-misses",
+    "PAPI_L3_TCA": "cache-references",
+    "PAPI_L3_TCM": "cache-misses",
+    "PAPI_TLB_DM": "dTLB-load-misses",
+    "PAPI_TLB_IM": "iTLB-load-misses",
+    "PAPI_BR_INS": "branches",
+    "PAPI_BR_MSP": "branch-misses",
+    "PAPI_REF_CYC": "ref-cycles",
+    "L1D:REPL": "l1d.replacement"
+}
+
+def load_counters_list(path=COUNTERS_LIST):
+    # Same format polybench.c #includes: quoted names separated by ',' with C/C++ comments
+    with open(path, 'r') as f:
+        text = f.read()
+    text = re.sub(r"/\*.*?\*/", "", text, flags=re.S)
+    text = re.sub(r"//[^\n]*", "", text)
+    return [name.strip().strip('"') for name in text.split(",") if name.strip().strip('"')]
+
+def perf_events(counters_list=COUNTERS_LIST):
+    events = list(BASE_EVENTS)
+    try:
+        papi_names = load_counters_list(counters_list)
+    except OSError:
+        print(f"[WARNING] {counters_list} not found, collecting the base events only")
+        papi_names = []
+    for name in papi_names:
+        event = PAPI_TO_PERF.get(name)
+        if event is None:
+            print(f"[WARNING] No perf equivalent for PAPI event {name}, skipping it")
+        elif event not in events:
+            events.append(event)
+    return events
+
+def parse_interval_output(text):
+    # perf stat -x, -I lines: time,count,unit,event,run time,pct,...
+    intervals = {}
+    for line in text.splitlines():
+        fields = line.split(",")
+        if len(fields) < 4 or line.startswith("#"):
+            continue
+        try:
+            timestamp = float(fields[0])
+        except ValueError:
+            continue
+        try:
+            count = float(fields[1])
+        except ValueError:
+            count = None  # <not counted> / <not supported>
+        intervals.setdefault(timestamp, {})[fields[3]] = count
+    return sorted(intervals.items())
+
+def split_phases(intervals, kernel_time, interval_ms=INTERVAL_MS):
+    # The kernel is the last thing a POLYBENCH_TIME build does before printing its time and exiting,
+    # so the final kernel_time seconds of the run are attributed to the kernel (interval counts are
+    # prorated at the boundary) and everything before that to runtime startup and array initialisation.
+    # The split is only as good as the interval resolution, so short kernels get whole-run counts only
+    kernel_intervals = kernel_time / (interval_ms / 1000) if kernel_time is not None else None
+    if kernel_intervals is not None and kernel_intervals < MIN_KERNEL_INTERVALS:
+        print(f"[WARNING] Kernel spans {kernel_intervals:.1f} perf intervals, fewer than {MIN_KERNEL_INTERVALS}; "
+              f"not splitting kernel and startup counters")
+        kernel_time = None
+    totals, kernel = {}, {}
+    end = intervals[-1][0] if intervals else 0.0
+    kernel_start = end - kernel_time if kernel_time is not None else end
+    previous = 0.0
+    for timestamp, counts in intervals:
+        length = timestamp - previous
+        overlap = max(0.0, timestamp - max(previous, kernel_start))
+        fraction = overlap / length if length > 0 else 0.0
+        for event, count in counts.items():
+            if count is None:
+                totals.setdefault(event, None)
+                kernel.setdefault(event, None)
+                continue
+            totals[event] = (totals.get(event) or 0) + count
+            kernel[event] = (kernel.get(event) or 0) + count * fraction
+        previous = timestamp
+
+    phases = {"total": totals}
+    if kernel_time is not None:
+        # Prorating by time assumes an even event rate inside the boundary interval
+        phases["split"] = {"kernel_intervals": kernel_intervals, "approximate": True}
+        phases["kernel"] = kernel
+        phases["startup"] = {event: totals[event] - kernel[event] if totals[event] is not None else None
+                             for event in totals}
+    return phases
+
+def derived_metrics(counts):
+    def ratio(numerator, denominator):
+        n, d = counts.get(numerator), counts.get(denominator)
+        return n / d if n is not None and d else None
+    return {
+        "ipc": ratio("instructions", "cycles"),
+        "cache_miss_rate": ratio("cache-misses", "cache-references"),
+        "branch_miss_rate": ratio("branch-misses", "branches")
+    }
+
+def run_with_counters(command, events, interval_ms=INTERVAL_MS):
+    # perf writes to its own file so the program's stdout stays free for the kernel time
+    with tempfile.NamedTemporaryFile(mode='r', suffix=".perf") as perf_output:
+        perf_command = ["perf", "stat", "-x", ",", "-I", str(interval_ms), "-e", ",".join(events),
+                        "-o", perf_output.name, "--", *command]
+        process = subprocess.run(perf_command, capture_output=True, text=True, preexec_fn=topology.child_pinning())
+        text = perf_output.read()
+
+    if process.returncode != 0:
+        print(f"Error executing {' '.join(command)} under perf: {process.stderr.strip()}")
+        return None
+
+    kernel_time = runtimes.parse_kernel_time(process.stdout)
+    phases = split_phases(parse_interval_output(text), kernel_time, interval_ms)
+    for phase in ("total", "kernel", "startup"):
+        if phase in phases:
+            phases[phase].update(derived_metrics(phases[phase]))
+    return {"kernel_time": kernel_time, **phases}
+
+def summarize_runs(runs):
+    summary = {}
+    for phase in ("total", "kernel", "startup"):
+        # Kernel and startup counters only count when every run could be split
+        if not all(phase in run for run in runs):
+            continue
+        summary[phase] = {}
+        for key in runs[0][phase]:
+            values = [run[phase][key] for run in runs if run[phase].get(key) is not None]
+            summary[phase][key] = stats.summarize(values) if values else None
+    return summary
+
+def measure(command, label, events, repetitions=REPETITIONS):
+    runs = []
+    for _ in range(repetitions):
+        run = run_with_counters(command, events)
+        if run is None:
+            return {"error": f"{label} failed under perf stat"}
+        runs.append(run)
+
+    summary = summarize_runs(runs)
+    ipc = summary["total"].get("ipc")
+    print(f"{label}: median IPC {ipc['median'] if ipc else None}, "
+          f"median cycles {summary['total']['cycles']['median'] if summary['total'].get('cycles') else None}")
+    if "kernel" in summary and summary["kernel"].get("ipc"):
+        print(f"{label}: kernel IPC {summary['kernel']['ipc']['median']}, "
+              f"startup IPC {summary['startup']['ipc']['median'] if summary['startup'].get('ipc') else None}")
+    return {"events": events, "runs": runs, **summary}
+
+def main(file_name, opt_level, results_dir=RESULTS_DIR, repetitions=REPETITIONS, counters_list=COUNTERS_LIST,
+         use_aot=False):
+    if not os.path.exists(results_dir):
+        os.makedirs(results_dir)
+
+    if shutil.which("perf") is None:
+        raise RuntimeError("perf is not installed; install linux-tools for the running kernel")
+
+    events = perf_events(counters_list)
+    results = {}
+
+    # The POLYBENCH_TIME builds (compile.py --variant time) let the kernel phase be separated;
+    # without them only whole-run counters are reported
+    native_file = os.path.join(COMPILED_DIR, compile.artifact_name(file_name, opt_level, "native", "time"))
+    wasm_file = os.path.join(COMPILED_DIR, compile.artifact_name(file_name, opt_level, "wasm", "time"))
+    if not os.path.isfile(native_file):
+        native_file = os.path.join(COMPILED_DIR, compile.artifact_name(file_name, opt_level, "native"))
+    if not os.path.isfile(wasm_file):
+        wasm_file = os.path.join(COMPILED_DIR, compile.artifact_name(file_name, opt_level, "wasm"))
+
+    if os.path.isfile(native_file):
+        results["native"] = measure([native_file], "native", events, repetitions)
+    else:
+        print(f"Native binary {native_file} not found.")
+
+    if os.path.isfile(wasm_file):
+        for runtime in RUNTIMES:
+            if use_aot:
+                try:
+                    precompiled = aot.precompile(runtime, wasm_file)
+                except (OSError, RuntimeError) as e:
+                    print(f"Error: {e}")
+                    results[f"{runtime}_aot"] = {"error": str(e)}
+                    continue
+                results[f"{runtime}_aot"] = measure(runtimes.wasm_command(runtime, precompiled["artifact"], True),
+                                                    f"{runtime} (AOT)", events, repetitions)
+            else:
+                results[runtime] = measure(runtimes.wasm_command(runtime, wasm_file), runtime, events, repetitions)
+    else:
+        print(f"WASM file {wasm_file} not found.")
+
+    json_output_file = os.path.join(results_dir, f"{file_name}_{opt_level}_perf_counters.json")
+    with open(json_output_file, 'w') as json_file:
+        json.dump(results, json_file, indent=4)
+
+    print(f"Performance counter results saved to {json_output_file}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Collect hardware performance counters for native and WASM runs with perf stat.')
+    parser.add_argument('file_name', type=str, help='Name of the file to run')
+    parser.add_argument('opt_level', type=int, choices=[0, 1, 2, 3], help='Optimization level (0, 1, 2, 3)')
+    parser.add_argument('--results-dir', type=str, default=RESULTS_DIR, help='Directory to write the results JSON to')
+    parser.add_argument('--repetitions', type=int, default=REPETITIONS, help='Runs per target')
+    parser.add_argument('--counters-list', type=str, default=COUNTERS_LIST, help='PAPI counter list to translate to perf events')
+    parser.add_argument('--use-aot', action='store_true', help='Run ahead-of-time compiled artifacts of the WASM file')
+    args = parser.parse_args()
+    main(args.file_name, args.opt_level, args.results_dir, args.repetitions, args.counters_list, args.use_aot)
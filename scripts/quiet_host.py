@@ -0,0 +1,164 @@
+import os
+import sys
+import json
+import shutil
+import subprocess
+import argparse
+import contextlib
+
+import topology
+
+# Low-noise measurement mode: pinned frequency governor and turbo, SCHED_FIFO and a flushed LLC per run,
+# the harness-side equivalent of polybench_linux_fifo_scheduler and polybench_flush_cache
+CPU_ROOT = "/sys/devices/system/cpu"
+INTEL_NO_TURBO = os.path.join(CPU_ROOT, "intel_pstate", "no_turbo")  # 1 = turbo off
+CPUFREQ_BOOST = os.path.join(CPU_ROOT, "cpufreq", "boost")  # 0 = turbo off
+GOVERNOR = "performance"
+FIFO_PRIORITY = 99  # Same as polybench's sched_get_priority_max(SCHED_FIFO); RT throttling still applies
+FALLBACK_LLC_BYTES = 32 * 1024 * 1024  # polybench flushes 32 MB when the cache size is unknown
+
+# Run in a short-lived helper pinned to the measured CPU, so the buffer never counts towards the
+# launcher's memory (which a measured child's ru_maxrss inherits); writing then scanning one
+# LLC-sized buffer brings every line of it through the cache, like polybench_flush_cache
+FLUSH_PROGRAM = """
+import os, sys
+os.sched_setaffinity(0, {int(sys.argv[1])})
+buffer = bytearray(b"\\1") * int(sys.argv[2])
+sys.exit(buffer.count(0))
+"""
+
+# Settings in effect while a measurement runs in quiet mode, None otherwise
+active = None
+
+def read_value(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def write_value(path, value):
+    try:
+        with open(path, 'w') as f:
+            f.write(str(value))
+        return True
+    except OSError as e:
+        print(f"[WARNING] Could not write {value} to {path}: {e}")
+        return False
+
+def parse_size(text):
+    units = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}
+    if text and text[-1] in units:
+        return int(text[:-1]) * units[text[-1]]
+    return int(text) if text else None
+
+def llc_size(cpu=0):
+    """Size in bytes of the highest-level data or unified cache of a CPU."""
+    cache_root = os.path.join(CPU_ROOT, f"cpu{cpu}", "cache")
+    caches = []
+    for entry in sorted(os.listdir(cache_root)) if os.path.isdir(cache_root) else []:
+        index = os.path.join(cache_root, entry)
+        if entry.startswith("index") and read_value(os.path.join(index, "type")) in ("Data", "Unified"):
+            caches.append((int(read_value(os.path.join(index, "level")) or 0),
+                           parse_size(read_value(os.path.join(index, "size")))))
+    return max(caches)[1] if caches else None
+
+def governor_path(cpu):
+    return os.path.join(CPU_ROOT, f"cpu{cpu}", "cpufreq", "scaling_governor")
+
+def read_turbo():
+    # Reported as "enabled" regardless of which driver exposes the switch
+    no_turbo = read_value(INTEL_NO_TURBO)
+    if no_turbo is not None:
+        return {"path": INTEL_NO_TURBO, "enabled": no_turbo == "0"}
+    boost = read_value(CPUFREQ_BOOST)
+    if boost is not None:
+        return {"path": CPUFREQ_BOOST, "enabled": boost == "1"}
+    return None
+
+def write_turbo(turbo, enabled):
+    value = ("0" if enabled else "1") if turbo["path"] == INTEL_NO_TURBO else ("1" if enabled else "0")
+    return write_value(turbo["path"], value)
+
+def flush_llc(cpu, flush_bytes):
+    result = subprocess.run([sys.executable, "-c", FLUSH_PROGRAM, str(cpu), str(flush_bytes)], capture_output=True,
+                            text=True)
+    if result.returncode != 0:
+        print(f"[WARNING] LLC flush on CPU {cpu} failed: {result.stderr.strip()}")
+
+def apply(governor=GOVERNOR, disable_turbo=True, fifo_priority=FIFO_PRIORITY, flush=True):
+    """Record the host's settings, then pin them for the CPUs this process may run on."""
+    global active
+    cpus = topology.measured_cpus()
+    previous_governors = {cpu: read_value(governor_path(cpu)) for cpu in cpus}
+    turbo = read_turbo()
+
+    applied_governors = {cpu: governor for cpu, value in previous_governors.items()
+                         if value is not None and (value == governor or write_value(governor_path(cpu), governor))}
+    turbo_pinned = False
+    if turbo and disable_turbo:
+        turbo_pinned = not turbo["enabled"] or write_turbo(turbo, False)
+
+    chrt = shutil.which("chrt")
+    if fifo_priority and not chrt:
+        print("[WARNING] chrt not found, measured processes keep the default scheduler")
+
+    flush_bytes = (llc_size(cpus[0]) or FALLBACK_LLC_BYTES) if flush else None
+
+    active = {
+        "cpus": cpus,
+        "governor": governor if applied_governors else None,
+        "previous_governors": previous_governors,
+        "governor_pinned_cpus": sorted(applied_governors),
+        "turbo_driver": turbo["path"] if turbo else None,
+        "turbo_was_enabled": turbo["enabled"] if turbo else None,
+        "turbo_disabled": turbo_pinned,
+        "scheduler": "SCHED_FIFO" if fifo_priority and chrt else "default",
+        "fifo_priority": fifo_priority if fifo_priority and chrt else None,
+        "llc_flush_bytes": flush_bytes
+    }
+    return active
+
+def restore(settings):
+    """Put back the governors and turbo state recorded by apply()."""
+    global active
+    for cpu in settings["governor_pinned_cpus"]:
+        previous = settings["previous_governors"].get(cpu)
+        if previous and previous != settings["governor"]:
+            write_value(governor_path(cpu), previous)
+    if settings["turbo_disabled"] and settings["turbo_was_enabled"]:
+        write_turbo({"path": settings["turbo_driver"]}, True)
+    active = None
+
+@contextlib.contextmanager
+def quiet(enabled=True, **kwargs):
+    """Quiet the host for the duration of a measurement; yields the applied settings (None when disabled)."""
+    if not enabled:
+        yield None
+        return
+    settings = apply(**kwargs)
+    try:
+        yield settings
+    finally:
+        restore(settings)
+
+def prepare(command):
+    """Flush the LLC and return the command to run under SCHED_FIFO; unchanged outside quiet mode."""
+    if active is None:
+        return command
+    if active["llc_flush_bytes"]:
+        flush_llc(topology.measured_cpus()[0], active["llc_flush_bytes"])
+    if active["fifo_priority"]:
+        return ["chrt", "-f", str(active["fifo_priority"])] + list(command)
+    return command
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Show what quiet host mode would record and pin on this host.')
+    parser.add_argument('--apply', action='store_true', help='Apply the settings, print them and restore the host')
+    args = parser.parse_args()
+    if args.apply:
+        with quiet() as settings:
+            print(json.dumps(settings, indent=4))
+    else:
+        print(json.dumps({"governors": {cpu: read_value(governor_path(cpu)) for cpu in sorted(os.sched_getaffinity(0))},
+                          "turbo": read_turbo(), "llc_bytes": llc_size(), "chrt": shutil.which("chrt")}, indent=4))
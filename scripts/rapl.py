@@ -1,100 +1,203 @@
 import subprocess
 import time
 import os
-import sys
+import shlex
+import argparse
 import json
 
+import aot
+import rapl_reader
+import quiet_host
+import topology
+
 # Constants
-RAPL_PATH = "/sys/class/powercap/intel-rapl/intel-rapl:0/energy_uj"
+RAPL_ROOT = rapl_reader.POWERCAP_ROOT
 ITERATIONS = 2
-CPU_CORE = '0'
 BASE_PATH = "/root/profiler/compiled"
 WASM_RUNTIMES = ['wasmer', 'wasmtime', 'wavm', 'iwasm']
 RESULTS_DIR = "/root/profiler/results/rapl"
+BASELINE_DURATION = 1.0  # Seconds of idle sampling before each batch
+PROCESS_POLL_INTERVAL = 0.01
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+def read_system_busy_time():
+    # Aggregate "cpu" line of /proc/stat: user nice system idle iowait irq softirq steal ...
+    with open('/proc/stat', 'r') as f:
+        values = [int(v) for v in f.readline().split()[1:9]]
+    return (sum(values) - values[3] - values[4]) / CLOCK_TICKS
+
+def read_process_cpu_time(pid):
+    # utime and stime are fields 14 and 15; split after the parenthesised command name
+    with open(f'/proc/{pid}/stat', 'r') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
 
-def read_energy():
-    with open(RAPL_PATH, 'r') as f:
-        return int(f.read().strip())
+def measure_idle_baseline(rapl_root=RAPL_ROOT, duration=BASELINE_DURATION):
+    # Power drawn per domain while nothing runs on the pinned core
+    sampler = rapl_reader.RaplSampler(rapl_root).start()
+    time.sleep(duration)
+    domain_energy = sampler.stop()
+    return {domain: (energy / 1e6) / sampler.elapsed for domain, energy in domain_energy.items()}
 
-def execute_command(command):
-    start_energy = read_energy()
-    start_time = time.time()
+def execute_command(command, idle_power, rapl_root=RAPL_ROOT):
+    # Pin to the core the scheduler leased to this cell (the first one we may run on when unpinned);
+    # in quiet mode the LLC is flushed here, before the energy window opens
+    cpu_core = str(topology.measured_cpus()[0])
+    command = quiet_host.prepare(["taskset", "-c", cpu_core] + shlex.split(command))
+    busy_start = read_system_busy_time()
+    sampler = rapl_reader.RaplSampler(rapl_root).start()
     # Execute the command in a new process with CPU affinity set
-    subprocess.run(f"taskset -c {CPU_CORE} {command}", shell=True, check=True)
-    end_time = time.time()
-    end_energy = read_energy()
-    energy_used = end_energy - start_energy
-    time_taken = end_time - start_time  # Time in seconds
+    process = subprocess.Popen(command)
+    cpu_time = 0.0
+    while True:
+        pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+        if pid:
+            break
+        try:
+            cpu_time = read_process_cpu_time(process.pid)
+        except (OSError, IndexError, ValueError):
+            pass
+        time.sleep(PROCESS_POLL_INTERVAL)
+    domain_energy = sampler.stop()
+    busy_time = read_system_busy_time() - busy_start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+    # The final rusage includes the last slice that /proc/<pid>/stat could no longer show
+    cpu_time = max(cpu_time, rusage.ru_utime + rusage.ru_stime)
+    energy_used = rapl_reader.package_total(domain_energy)  # Summed over sockets, in microjoules
+    time_taken = sampler.elapsed  # Time in seconds
     power_used = (energy_used / 1e6) / time_taken  # Energy in Joules, Power in Watts
-    return energy_used, power_used
+
+    idle_energy = rapl_reader.package_total(idle_power) * time_taken * 1e6
+    net_energy = max(energy_used - idle_energy, 0)
+    # Energy above idle is split by the child's share of all CPU time used on the host meanwhile
+    cpu_share = min(cpu_time / busy_time, 1.0) if busy_time > 0 else 1.0
+    return {
+        "energy_uJ": energy_used,
+        "power_W": power_used,
+        "domain_energy_uJ": domain_energy,
+        "net_energy_uJ": net_energy,
+        "attributed_energy_uJ": net_energy * cpu_share,
+        "cpu_time_s": cpu_time,
+        "cpu_share": cpu_share,
+        "series": sampler.series
+    }
 
 def average_measurements(measurements):
-    average_energy = sum([m[0] for m in measurements]) / ITERATIONS
-    average_power = sum([m[1] for m in measurements]) / ITERATIONS
+    average_energy = sum([m["energy_uJ"] for m in measurements]) / ITERATIONS
+    average_power = sum([m["power_W"] for m in measurements]) / ITERATIONS
     return average_energy, average_power
 
-def process_native(file_name, opt_level):
+def average_domains(measurements):
+    return {domain: sum(m["domain_energy_uJ"][domain] for m in measurements) / len(measurements)
+            for domain in measurements[0]["domain_energy_uJ"]}
+
+def summarize_batch(measurements, idle_power):
+    average_energy, average_power = average_measurements(measurements)
+    return {
+        "average_energy_uJ": average_energy,
+        "average_power_W": average_power,
+        "idle_power_W": rapl_reader.package_total(idle_power),
+        "idle_domain_power_W": idle_power,
+        "average_net_energy_uJ": sum(m["net_energy_uJ"] for m in measurements) / len(measurements),
+        "average_attributed_energy_uJ": sum(m["attributed_energy_uJ"] for m in measurements) / len(measurements),
+        "average_cpu_share": sum(m["cpu_share"] for m in measurements) / len(measurements),
+        "average_domain_energy_uJ": average_domains(measurements),
+        "energy_series": [m["series"] for m in measurements]
+    }
+
+def process_native(file_name, opt_level, rapl_root=RAPL_ROOT):
     native_file = f"{BASE_PATH}/{file_name}_{opt_level}_native"
     # Ensure the native file is executable
     if not os.access(native_file, os.X_OK):
         os.chmod(native_file, 0o755)
     file_name_base = os.path.basename(native_file)
+    idle_power = measure_idle_baseline(rapl_root)
+    print(f"Idle baseline power: {rapl_reader.package_total(idle_power)} W")
     print(f"Executing native file: {file_name_base}")
     measurements = []
     for _ in range(ITERATIONS):
-        measurements.append(execute_command(f"{native_file}"))
-    average_energy, average_power = average_measurements(measurements)
-    print(f"Results for {file_name_base}: Average Energy (uJ): {average_energy}, Average Power (W): {average_power}")
-    return {
-        "file": file_name_base,
-        "average_energy_uJ": average_energy,
-        "average_power_W": average_power
-    }
+        measurements.append(execute_command(f"{native_file}", idle_power, rapl_root))
+    results = summarize_batch(measurements, idle_power)
+    print(f"Results for {file_name_base}: Average Energy (uJ): {results['average_energy_uJ']}, Average Power (W): {results['average_power_W']}, "
+          f"Net Energy (uJ): {results['average_net_energy_uJ']}, Attributed Energy (uJ): {results['average_attributed_energy_uJ']}")
+    return {"file": file_name_base, **results}
 
-def process_wasm(file_name, opt_level):
+def process_wasm(file_name, opt_level, use_aot=False, rapl_root=RAPL_ROOT):
     wasm_file = f"{BASE_PATH}/{file_name}_{opt_level}.wasm"
     file_name_base = os.path.basename(wasm_file)
     results = {}
     for runtime in WASM_RUNTIMES:
+        idle_power = measure_idle_baseline(rapl_root)
+        print(f"Idle baseline power: {rapl_reader.package_total(idle_power)} W")
         print(f"Executing {runtime} with file: {file_name_base}")
+        if use_aot:
+            try:
+                precompiled = aot.precompile(runtime, wasm_file)
+            except (OSError, RuntimeError) as e:
+                print(f"Error: {e}")
+                results[runtime] = {"error": str(e)}
+                continue
         measurements = []
         for _ in range(ITERATIONS):
-            if runtime == 'wavm':
+            if use_aot:
+                command = shlex.join(aot.run_command(runtime, precompiled["artifact"]))
+            elif runtime == 'wavm':
                 command = f"{runtime} run --enable simd {wasm_file}"
             else:
                 command = f"{runtime} {wasm_file}"
-            measurements.append(execute_command(command))
-        average_energy, average_power = average_measurements(measurements)
-        print(f"Results for {runtime} with {file_name_base}: Average Energy (uJ): {average_energy}, Average Power (W): {average_power}")
-        results[runtime] = {
-            "average_energy_uJ": average_energy,
-            "average_power_W": average_power
-        }
+            measurements.append(execute_command(command, idle_power, rapl_root))
+        results[runtime] = summarize_batch(measurements, idle_power)
+        if use_aot:
+            results[runtime]["aot_compile_time"] = precompiled["compile_time"]
+            results[runtime]["aot_cache_hit"] = precompiled["cache_hit"]
+        print(f"Results for {runtime} with {file_name_base}: Average Energy (uJ): {results[runtime]['average_energy_uJ']}, "
+              f"Average Power (W): {results[runtime]['average_power_W']}, Net Energy (uJ): {results[runtime]['average_net_energy_uJ']}, "
+              f"Attributed Energy (uJ): {results[runtime]['average_attributed_energy_uJ']}")
     return results
 
-def main(file_name, opt_level):
-    if not os.path.exists(RESULTS_DIR):
-        os.makedirs(RESULTS_DIR)
+def main(file_name, opt_level, results_dir=RESULTS_DIR, rapl_root=None, use_aot=False, quiet=False):
+    # Passed down rather than set on the module, which stays loaded in a long-lived pool worker
+    rapl_root = rapl_root or RAPL_ROOT
 
-    results = {
-        "native": process_native(file_name, opt_level),
-        "wasm": process_wasm(file_name, opt_level)
-    }
+    if not os.path.exists(results_dir):
+        os.makedirs(results_dir)
+
+    settings = None
+    try:
+        rapl_reader.discover_domains(rapl_root)
+    except rapl_reader.RaplUnavailable as e:
+        # Without package counters every reading would be 0 uJ, which must not pass for a measurement
+        print(f"Error: {e}")
+        results = {"error": str(e)}
+    else:
+        with quiet_host.quiet(quiet) as settings:
+            results = {
+                "native": process_native(file_name, opt_level, rapl_root),
+                "wasm": process_wasm(file_name, opt_level, use_aot, rapl_root)
+            }
+    if settings:
+        results["quiet_host"] = settings
 
     # Save results to JSON file
-    json_output_file = os.path.join(RESULTS_DIR, f"{file_name}_{opt_level}_rapl.json")
+    json_output_file = os.path.join(results_dir, f"{file_name}_{opt_level}_rapl.json")
     with open(json_output_file, 'w') as json_file:
         json.dump(results, json_file, indent=4)
     
     print(f"RAPL results saved to {json_output_file}")
+    return results
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python3 script.py <file_name> <opt_level>")
-        sys.exit(1)
-
-    file_name = sys.argv[1]
-    opt_level = sys.argv[2]
+    parser = argparse.ArgumentParser()
+    parser.add_argument('file_name', type=str, help='Name of the file to run')
+    parser.add_argument('opt_level', type=int, help='Optimization level of the file')
+    parser.add_argument('--results-dir', type=str, default=RESULTS_DIR, help='Directory to write the results JSON to')
+    parser.add_argument('--rapl-root', type=str, default=RAPL_ROOT, help='powercap sysfs root, e.g. a fake tree for testing')
+    parser.add_argument('--use-aot', action='store_true', help='Run ahead-of-time compiled artifacts of the WASM file')
+    parser.add_argument('--quiet', action='store_true', help='Pin governor and turbo, run under SCHED_FIFO and flush the LLC before each run')
+    args = parser.parse_args()
 
-    main(file_name, opt_level)
+    main(args.file_name, args.opt_level, args.results_dir, args.rapl_root, args.use_aot, args.quiet)
 
@@ -0,0 +1,105 @@
+import os
+import time
+import threading
+
+# Every RAPL zone (and subzone) is linked flat under the powercap class directory;
+# pass a different root to read from a fake sysfs tree on machines without RAPL
+POWERCAP_ROOT = "/sys/class/powercap"
+ZONE_PREFIX = "intel-rapl:"
+SAMPLE_INTERVAL = 0.1  # Seconds; far below the shortest counter wrap period
+
+class RaplUnavailable(RuntimeError):
+    pass
+
+def read_value(path):
+    with open(path, 'r') as f:
+        return f.read().strip()
+
+def discover_domains(root=POWERCAP_ROOT):
+    """Readable RAPL domains; raises RaplUnavailable when there is no readable package domain to measure with."""
+    try:
+        entries = sorted(os.listdir(root))
+    except OSError as e:
+        raise RaplUnavailable(f"No RAPL powercap tree at {root}: {e}")
+    zones = {}
+    unreadable = []
+    for entry in entries:
+        if not entry.startswith(ZONE_PREFIX):
+            continue
+        zone_path = os.path.join(root, entry)
+        try:
+            zones[entry] = {
+                "path": os.path.join(zone_path, "energy_uj"),
+                "name": read_value(os.path.join(zone_path, "name")),
+                "max_energy_range_uj": int(read_value(os.path.join(zone_path, "max_energy_range_uj")))
+            }
+            int(read_value(zones[entry]["path"]))
+        except (OSError, ValueError):
+            zones.pop(entry, None)  # energy_uj is root-only on recent kernels
+            unreadable.append(entry)
+
+    # Subzone names (core, uncore, dram) repeat per socket, so qualify them with their package
+    domains = {}
+    for zone_id, zone in zones.items():
+        parent_id = zone_id.rsplit(":", 1)[0]
+        if parent_id in zones and parent_id != zone_id:
+            key = f"{zones[parent_id]['name']}/{zone['name']}"
+        else:
+            key = zone["name"]
+        domains[key] = zone
+    if not any(key.startswith("package-") and "/" not in key for key in domains):
+        reason = f"{len(unreadable)} zone(s) unreadable, energy_uj is root-only on recent kernels" if unreadable \
+            else "no package zones"
+        raise RaplUnavailable(f"No readable RAPL package domain under {root} ({reason})")
+    return domains
+
+def read_counters(domains):
+    return {key: int(read_value(domain["path"])) for key, domain in domains.items()}
+
+def counter_delta(before, after, max_energy_range_uj):
+    # The counter wraps back to zero after max_energy_range_uj
+    if after >= before:
+        return after - before
+    return after + max_energy_range_uj - before
+
+def package_total(energy):
+    packages = [value for key, value in energy.items() if key.startswith("package-") and "/" not in key]
+    if not packages:
+        raise RaplUnavailable("No package domain in the energy readings")
+    return sum(packages)
+
+class RaplSampler:
+    """Accumulates wraparound-corrected energy per domain while a workload runs."""
+
+    def __init__(self, root=POWERCAP_ROOT, interval=SAMPLE_INTERVAL, domains=None):
+        self.domains = domains if domains is not None else discover_domains(root)
+        self.interval = interval
+        self.energy = {key: 0 for key in self.domains}
+        self.series = []
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        counters = read_counters(self.domains)
+        now = time.time()
+        for key, value in counters.items():
+            self.energy[key] += counter_delta(self.last[key], value, self.domains[key]["max_energy_range_uj"])
+        self.last = counters
+        self.series.append({"time": now - self.start_time, "energy_uj": dict(self.energy)})
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self.last = read_counters(self.domains)
+        self.start_time = time.time()
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self._sample()
+        self.elapsed = time.time() - self.start_time
+        return dict(self.energy)
@@ -5,136 +5,184 @@ import time
 import argparse
 import json
 
+import aot
+import quiet_host
+import runtimes
+import topology
+
+RESULTS_DIR = "/root/profiler/results/rss"
+
+MIN_INTERVAL = 0.001  # Sample every millisecond at first, then back off towards --interval
+
 def get_current_rss(pid):
     with open(f'/proc/{pid}/statm', 'r') as f:
         return int(f.readline().split()[1]) * (os.sysconf('SC_PAGE_SIZE') / 1024)  # Convert pages to kilobytes
 
-def monitor_rss(process, interval, memory_usage_list, start_time, time_list):
-    while True:
-        if process.poll() is not None:
-            break  # Exit the loop if the process has terminated
-        rss = get_current_rss(process.pid)
-        memory_usage_list.append(rss)
-        time_list.append(time.time() - start_time)
-        time.sleep(interval)
-
-def run_and_monitor_wasm(runtime, file_path, interval):
-    command_map = {
-        "wasmer": ["wasmer", file_path],
-        "wasmtime": ["wasmtime", file_path],
-        "wavm": ["wavm", "run", file_path],
-        "iwasm": ["iwasm", file_path],
-    }
+def get_vm_hwm(pid):
+    # Kernel-tracked peak RSS in kilobytes; absent once the process has exited
+    with open(f'/proc/{pid}/status', 'r') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    return None
+
+def monitor_rss(pid, stop_event, max_interval, memory_usage_list, start_time, time_list, sampler_stats):
+    # Must not poll() the child: the main thread reaps it with os.wait4 to get its rusage
+    cpu_start = time.thread_time()
+    interval = MIN_INTERVAL
+    while not stop_event.is_set():
+        try:
+            rss = get_current_rss(pid)
+            vm_hwm = get_vm_hwm(pid)
+        except (OSError, IndexError, ValueError):
+            break
+        if rss:
+            memory_usage_list.append(rss)
+            time_list.append(time.time() - start_time)
+        if vm_hwm:
+            sampler_stats["vm_hwm"] = max(sampler_stats["vm_hwm"] or 0, vm_hwm)
+        stop_event.wait(interval)
+        interval = min(interval * 2, max_interval)
+    sampler_stats["cpu_time"] = time.thread_time() - cpu_start
+
+def run_and_monitor(command, interval):
+    # The child's ru_maxrss also counts the launcher's memory from before exec,
+    # so it only pins down the program's own peak when it exceeds this value
+    launcher_hwm = get_vm_hwm(os.getpid())
+    command = quiet_host.prepare(command)
     start_time = time.time()
-    command = command_map.get(runtime)
-    if command is None:
-        print(f"Runtime {runtime} is not supported.")
-        return None, None, None
-    
-    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               preexec_fn=topology.child_pinning())
     memory_usage_list, time_list = [], []
-    monitor_thread = threading.Thread(target=monitor_rss, args=(process, interval, memory_usage_list, start_time, time_list))
+    sampler_stats = {"vm_hwm": None, "cpu_time": 0.0}
+    stop_event = threading.Event()
+    monitor_thread = threading.Thread(target=monitor_rss, args=(process.pid, stop_event, interval, memory_usage_list,
+                                                                start_time, time_list, sampler_stats))
     monitor_thread.start()
-    process.wait()
+    _, status, rusage = os.wait4(process.pid, 0)
+    total_time = time.time() - start_time
+    process.returncode = os.waitstatus_to_exitcode(status)
+    stop_event.set()
     monitor_thread.join()
 
-    if process.returncode != 0:
-        print(f"Error executing {runtime} with file {file_path}")
-        return [], [], 0
+    return {
+        "returncode": process.returncode,
+        "memory_usage_list": memory_usage_list,
+        "time_list": time_list,
+        "total_time": total_time,
+        "ru_maxrss": rusage.ru_maxrss,  # Kilobytes on Linux
+        "ru_maxrss_exact": rusage.ru_maxrss > (launcher_hwm or 0),
+        "vm_hwm": sampler_stats["vm_hwm"],
+        "sampling_cpu_time": sampler_stats["cpu_time"]
+    }
 
-    return memory_usage_list, time_list, time.time() - start_time
+def run_and_monitor_wasm(runtime, file_path, interval, precompiled=False):
+    command = runtimes.wasm_command(runtime, file_path, precompiled)
+    if command is None:
+        print(f"Runtime {runtime} is not supported.")
+        return None
+
+    run = run_and_monitor(command, interval)
+    if run["returncode"] != 0:
+        print(f"Error executing {runtime} with file {file_path}")
+        return None
+    return run
 
 def run_and_monitor_native(file_path, interval):
     # Ensure the command includes './' to execute from the current directory
     command = ["./" + file_path] if '/' not in file_path else [file_path]
-    start_time = time.time()
-    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    memory_usage_list, time_list = [], []
-    monitor_thread = threading.Thread(target=monitor_rss, args=(process, interval, memory_usage_list, start_time, time_list))
-    monitor_thread.start()
-    process.wait()
-    monitor_thread.join()
-
-    if process.returncode != 0:
+    run = run_and_monitor(command, interval)
+    if run["returncode"] != 0:
         print(f"Error executing native binary with file {file_path}")
-        return [], [], 0
+        return None
+    return run
+
+def summarize_rss(run):
+    rss_usage = run["memory_usage_list"]
+    total_time = run["total_time"]
+    sum_rss = sum(rss_usage)
+    avg_rss = sum_rss / len(rss_usage) if rss_usage else 0
+    sampled_max_rss = max(rss_usage) if rss_usage else 0
+    # ru_maxrss is exact even when the run is too short to be sampled
+    peak_candidates = [run["vm_hwm"] or 0, sampled_max_rss]
+    if run["ru_maxrss_exact"]:
+        peak_candidates.append(run["ru_maxrss"])
+    max_rss = max(peak_candidates)
+
+    results = {
+        "sum_rss": sum_rss,
+        "avg_rss": avg_rss,
+        "max_rss": max_rss,
+        "ru_maxrss": run["ru_maxrss"],
+        "ru_maxrss_exact": run["ru_maxrss_exact"],
+        "vm_hwm": run["vm_hwm"],
+        "sampled_max_rss": sampled_max_rss,
+        "samples": len(rss_usage),
+        "sampling_cpu_time": run["sampling_cpu_time"],
+        "sampling_overhead_pct": run["sampling_cpu_time"] / total_time * 100 if total_time > 0 else 0,
+        "total_time": total_time,
+        "rss_per_time": sum_rss / total_time if total_time > 0 else 0,
+        "avg_rss_per_time": avg_rss / total_time if total_time > 0 else 0
+    }
 
-    return memory_usage_list, time_list, time.time() - start_time
+    print(f"Sum of RSS: {sum_rss} KB")
+    print(f"Average RSS: {avg_rss} KB")
+    print(f"Maximum RSS: {max_rss} KB (ru_maxrss {run['ru_maxrss']} KB, VmHWM {run['vm_hwm']} KB, {len(rss_usage)} samples)")
+    print(f"Total time taken: {total_time} seconds")
+    print(f"Sampling overhead: {run['sampling_cpu_time']} s CPU ({results['sampling_overhead_pct']:.2f}% of wall time)")
+    print(f"Sum of RSS divided by total time: {results['rss_per_time']} KB/s")
+    print(f"Average RSS divided by total time: {results['avg_rss_per_time']} KB/s")
+    return results
 
-def main(file_name, opt_level, interval):
+def monitor_all(file_name, opt_level, interval, results, use_aot=False):
     base_path = "/root/profiler/compiled"
     native_file = f"{file_name}_{opt_level}_native"
     wasm_file = f"{file_name}_{opt_level}.wasm"
-    
-    results = {
-        "native": {},
-        "wasm": {}
-    }
 
     # Monitor native binary
     print("\nMonitoring native binary...")
     native_path = os.path.join(base_path, native_file)
-    rss_usage, time_list, total_time = run_and_monitor_native(native_path, interval)
-    if rss_usage:
-        sum_rss = sum(rss_usage)
-        avg_rss = sum_rss / len(rss_usage)
-        max_rss = max(rss_usage)
-        total_time = time_list[-1]  # Last recorded time is the total time
-        rss_per_time = sum_rss / total_time
-        avg_rss_per_time = avg_rss / total_time
-
-        results["native"] = {
-            "sum_rss": sum_rss,
-            "avg_rss": avg_rss,
-            "max_rss": max_rss,
-            "total_time": total_time,
-            "rss_per_time": rss_per_time,
-            "avg_rss_per_time": avg_rss_per_time
-        }
-        
-        print(f"Sum of RSS: {sum_rss} KB")
-        print(f"Average RSS: {avg_rss} KB")
-        print(f"Maximum RSS: {max_rss} KB")
-        print(f"Total time taken: {total_time} seconds")
-        print(f"Sum of RSS divided by total time: {rss_per_time} KB/s")
-        print(f"Average RSS divided by total time: {avg_rss_per_time} KB/s")
+    run = run_and_monitor_native(native_path, interval)
+    if run:
+        results["native"] = summarize_rss(run)
     else:
         print("No RSS data collected for native binary.")
 
     # Monitor WASM
     print("\nMonitoring WASM binaries...")
     wasm_path = os.path.join(base_path, wasm_file)
-    for runtime in ["wasmer", "wasmtime", "wavm", "iwasm"]:
+    for runtime in runtimes.RUNTIMES:
         print(f"\nRuntime: {runtime}")
-        rss_usage, time_list, total_time = run_and_monitor_wasm(runtime, wasm_path, interval)
-        if rss_usage:
-            sum_rss = sum(rss_usage)
-            avg_rss = sum_rss / len(rss_usage)
-            max_rss = max(rss_usage)
-            total_time = time_list[-1]  # Last recorded time is the total time
-            rss_per_time = sum_rss / total_time
-            avg_rss_per_time = avg_rss / total_time
-
-            results["wasm"][runtime] = {
-                "sum_rss": sum_rss,
-                "avg_rss": avg_rss,
-                "max_rss": max_rss,
-                "total_time": total_time,
-                "rss_per_time": rss_per_time,
-                "avg_rss_per_time": avg_rss_per_time
-            }
-
-            print(f"Sum of RSS: {sum_rss} KB")
-            print(f"Average RSS: {avg_rss} KB")
-            print(f"Maximum RSS: {max_rss} KB")
-            print(f"Total time taken: {total_time} seconds")
-            print(f"Sum of RSS divided by total time: {rss_per_time} KB/s")
-            print(f"Average RSS divided by total time: {avg_rss_per_time} KB/s")
+        if use_aot:
+            try:
+                precompiled = aot.precompile(runtime, wasm_path)
+            except (OSError, RuntimeError) as e:
+                print(f"Error: {e}")
+                results["wasm"][runtime] = {"error": str(e)}
+                continue
+            run = run_and_monitor_wasm(runtime, precompiled["artifact"], interval, True)
+        else:
+            run = run_and_monitor_wasm(runtime, wasm_path, interval)
+        if run:
+            results["wasm"][runtime] = summarize_rss(run)
+            if use_aot:
+                results["wasm"][runtime]["aot_compile_time"] = precompiled["compile_time"]
+                results["wasm"][runtime]["aot_cache_hit"] = precompiled["cache_hit"]
         else:
             print(f"No RSS data collected for {runtime}.")
 
+def main(file_name, opt_level, interval=0.05, results_dir=RESULTS_DIR, use_aot=False, quiet=False):
+    results = {
+        "native": {},
+        "wasm": {}
+    }
+
+    with quiet_host.quiet(quiet) as settings:
+        monitor_all(file_name, opt_level, interval, results, use_aot)
+    if settings:
+        results["quiet_host"] = settings
+
     # Save results to JSON file
-    results_dir = "/root/profiler/results/rss"
     if not os.path.exists(results_dir):
         os.makedirs(results_dir)
     json_output_file = os.path.join(results_dir, f"{file_name}_{opt_level}_rss.json")
@@ -142,12 +190,16 @@ def main(file_name, opt_level, interval):
         json.dump(results, json_file, indent=4)
     
     print(f"RSS results saved to {json_output_file}")
+    return results
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('file_name', type=str, help='Name of the file to monitor.')
     parser.add_argument('opt_level', type=int, help='Optimization level of the file.')
-    parser.add_argument('--interval', type=float, default=0.05, help='Interval for RSS monitoring in seconds.')
+    parser.add_argument('--interval', type=float, default=0.05, help='Longest interval between RSS samples in seconds.')
+    parser.add_argument('--results-dir', type=str, default=RESULTS_DIR, help='Directory to write the results JSON to.')
+    parser.add_argument('--use-aot', action='store_true', help='Run ahead-of-time compiled artifacts of the WASM file.')
+    parser.add_argument('--quiet', action='store_true', help='Pin governor and turbo, run under SCHED_FIFO and flush the LLC before each run.')
     args = parser.parse_args()
-    main(args.file_name, args.opt_level, args.interval)
+    main(args.file_name, args.opt_level, args.interval, args.results_dir, args.use_aot, args.quiet)
 
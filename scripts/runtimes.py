@@ -0,0 +1,26 @@
+import aot
+
+# The WASM runtimes every measurement script runs, and how each one is invoked on the host
+RUNTIMES = ["wasmer", "wasmtime", "wavm", "iwasm"]
+
+JIT_COMMANDS = {
+    "wasmer": lambda file_path: ["wasmer", file_path],
+    "wasmtime": lambda file_path: ["wasmtime", file_path],
+    "wavm": lambda file_path: ["wavm", "run", file_path],
+    "iwasm": lambda file_path: ["iwasm", file_path]
+}
+
+def wasm_command(runtime, file_path, precompiled=False):
+    """Command running a WASM file (or an AOT artifact from aot.precompile); None for an unknown runtime."""
+    if precompiled:
+        return aot.run_command(runtime, file_path)
+    command = JIT_COMMANDS.get(runtime)
+    return command(file_path) if command else None
+
+def parse_kernel_time(stdout):
+    # Binaries built with -DPOLYBENCH_TIME print the kernel's time (or cycle count) as their last line
+    lines = stdout.strip().splitlines()
+    try:
+        return float(lines[-1])
+    except (IndexError, ValueError):
+        return None
@@ -0,0 +1,137 @@
+import math
+import random
+import functools
+import statistics
+import collections
+
+BOOTSTRAP_RESAMPLES = 2000
+CONFIDENCE = 0.95
+
+# Set by the controller when a script runs in-process, to stream sample batches as they are measured
+progress_hook = None
+
+def report_samples(label, samples):
+    if progress_hook is not None:
+        progress_hook({"label": label, "samples": list(samples)})
+
+def bootstrap_ci(samples, estimator=statistics.median, confidence=CONFIDENCE, resamples=BOOTSTRAP_RESAMPLES, seed=0):
+    # Percentile bootstrap; fixed seed so reruns over the same samples report the same interval
+    if len(samples) < 2:
+        return [samples[0], samples[0]] if samples else [None, None]
+    rng = random.Random(seed)
+    estimates = sorted(estimator(rng.choices(samples, k=len(samples))) for _ in range(resamples))
+    tail = (1 - confidence) / 2
+    low = estimates[int(math.floor(tail * (resamples - 1)))]
+    high = estimates[int(math.ceil((1 - tail) * (resamples - 1)))]
+    return [low, high]
+
+@functools.lru_cache(maxsize=None)
+def bootstrap_median_ranks(n, resamples=BOOTSTRAP_RESAMPLES, seed=0):
+    # The ranks of the sorted samples a resample's median averages depend only on n, so the resampling is
+    # done once per sample count and shared by every comparison; returns ((low, high), resample count) pairs
+    rng = random.Random(seed)
+    ranks = collections.Counter()
+    for _ in range(resamples):
+        drawn = sorted(rng.choices(range(n), k=n))
+        ranks[(drawn[(n - 1) // 2], drawn[n // 2])] += 1
+    return tuple(ranks.items())
+
+def bootstrap_median_difference_ci(samples1, samples2, confidence=CONFIDENCE, resamples=BOOTSTRAP_RESAMPLES, seed=0):
+    # Percentile bootstrap of median(samples2) - median(samples1) over every pairing of the two sides' resamples;
+    # only the few distinct resample medians of each side are combined, weighted by how often they occur
+    if len(samples1) < 2 or len(samples2) < 2:
+        return None
+
+    def medians(samples):
+        ordered = sorted(samples)
+        return [((ordered[low] + ordered[high]) / 2, count)
+                for (low, high), count in bootstrap_median_ranks(len(samples), resamples, seed)]
+
+    differences = sorted((median2 - median1, count1 * count2)
+                         for median1, count1 in medians(samples1) for median2, count2 in medians(samples2))
+    tail = (1 - confidence) / 2 * resamples * resamples
+    low, cumulative = None, 0
+    for difference, weight in differences:
+        cumulative += weight
+        if low is None and cumulative > tail:
+            low = difference
+        if cumulative >= resamples * resamples - tail:
+            return [low, difference]
+    return [low, differences[-1][0]]
+
+def polybench_deviation(samples):
+    # Same check as utilities/time_benchmark.sh: drop the fastest and slowest run,
+    # average the rest and report the largest deviation from that average in percent
+    ordered = sorted(samples)
+    trimmed = ordered[1:-1] if len(ordered) >= 3 else ordered
+    normalized = statistics.fmean(trimmed)
+    max_deviation = max(abs(s - normalized) for s in trimmed)
+    return {
+        "normalized_time": normalized,
+        "max_deviation_pct": (max_deviation / normalized) * 100 if normalized else 0.0
+    }
+
+def summarize(samples, confidence=CONFIDENCE):
+    mean = statistics.fmean(samples)
+    stddev = statistics.stdev(samples) if len(samples) > 1 else 0.0
+    return {
+        "samples": list(samples),
+        "repetitions": len(samples),
+        "median": statistics.median(samples),
+        "mean": mean,
+        "stddev": stddev,
+        "cv": stddev / mean if mean else 0.0,
+        "min": min(samples),
+        "max": max(samples),
+        "confidence": confidence,
+        "median_ci": bootstrap_ci(samples, confidence=confidence)
+    }
+
+def regularized_incomplete_beta(x, a, b):
+    # Continued fraction evaluation (Numerical Recipes betacf), flipped for faster convergence when needed
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1 - x))
+    if x > (a + 1) / (a + b + 2):
+        return 1.0 - regularized_incomplete_beta(1 - x, b, a)
+    tiny = 1e-300
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    result = d
+    for m in range(1, 200):
+        for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                          -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1.0 + numerator * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            result *= c * d
+        if abs(c * d - 1.0) < 1e-12:
+            break
+    return front * result / a
+
+def welch_t_test(mean1, var1, n1, mean2, var2, n2):
+    # Two-sided Welch's t-test from summary statistics; None when either side has a single sample
+    if n1 < 2 or n2 < 2:
+        return None
+    se2 = var1 / n1 + var2 / n2
+    if se2 == 0:
+        return {"t": 0.0 if mean1 == mean2 else math.inf, "df": n1 + n2 - 2, "p_value": 1.0 if mean1 == mean2 else 0.0}
+    t = (mean2 - mean1) / math.sqrt(se2)
+    df = se2 ** 2 / ((var1 / n1) ** 2 / (n1 - 1) + (var2 / n2) ** 2 / (n2 - 1))
+    return {"t": t, "df": df, "p_value": regularized_incomplete_beta(df / (df + t * t), df / 2, 0.5)}
+
+def linear_fit(xs, ys):
+    # Ordinary least squares y = intercept + slope * x; None with fewer than two distinct x values
+    if len(xs) < 2 or len(set(xs)) < 2:
+        return None
+    mean_x, mean_y = statistics.fmean(xs), statistics.fmean(ys)
+    sxx = sum((x - mean_x) ** 2 for x in xs)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sxx
+    intercept = mean_y - slope * mean_x
+    ss_res = sum((y - intercept - slope * x) ** 2 for x, y in zip(xs, ys))
+    ss_tot = sum((y - mean_y) ** 2 for y in ys)
+    return {"intercept": intercept, "slope": slope, "r_squared": 1 - ss_res / ss_tot if ss_tot else 1.0,
+            "points": len(xs)}
@@ -0,0 +1,113 @@
+import os
+import argparse
+import json
+
+import compile
+import quiet_host
+import stats
+import times
+
+RESULTS_DIR = "/root/profiler/results/sweep"
+RUNTIMES = times.RUNTIMES
+REPETITIONS = 3  # Per size; the largest sizes run for minutes
+
+# Every size is built with -DPOLYBENCH_TIME so the native kernel time measures the work done at that size.
+# Each runtime's wall time is then fitted as fixed overhead + slope * native kernel time: the intercept is
+# startup cost that does not scale, the slope how much slower than native the runtime does the work.
+
+def build_sizes(file_name, opt_level, datasets, force=False):
+    binaries = {}
+    for dataset in datasets:
+        native_file, _ = compile.compile_native(file_name, opt_level, force, "time", dataset)
+        wasm_file, _ = compile.compile_wasm(file_name, opt_level, force, "time", dataset)
+        binaries[dataset] = (native_file, wasm_file)
+    return binaries
+
+def measure_point(run, label, trials):
+    # Runs that exit non-zero report no kernel time, so a summary without one holds failed runs
+    try:
+        summary = times.measure_repeated(run, label, *trials, kernel_unit="seconds")
+    except OSError as e:
+        print(f"Error: {e}")
+        return {"error": str(e)}
+    if "kernel_time" not in summary:
+        return {"error": "Failed run or no kernel time in the output", **summary}
+    return summary
+
+def measure_sizes(binaries, repetitions, warmup):
+    points = {"native": {}, **{runtime: {} for runtime in RUNTIMES}}
+    trials = (warmup, repetitions, times.VARIANCE_THRESHOLD, 0)
+    for dataset, (native_file, wasm_file) in binaries.items():
+        print(f"\nDataset: {dataset}")
+        if times.check_file_exists(native_file):
+            points["native"][dataset] = measure_point(lambda: times.run_native_file(native_file, True),
+                                                      f"native ({dataset})", trials)
+        else:
+            print(f"Native file {native_file} does not exist.")
+        if times.check_file_exists(wasm_file):
+            for runtime in RUNTIMES:
+                points[runtime][dataset] = measure_point(lambda: times.run_wasm_file(runtime, wasm_file, kernel_time=True),
+                                                         f"{runtime} ({dataset})", trials)
+        else:
+            print(f"WASM file {wasm_file} does not exist.")
+    return points
+
+def fit_scaling(points):
+    """Per-runtime fit of median wall time against the native kernel time of the same size; failed sizes are left out."""
+    work = {dataset: summary["kernel_time"]["median"] for dataset, summary in points["native"].items()
+            if "error" not in summary}
+    fits = {}
+    for runtime, sizes in points.items():
+        datasets = [dataset for dataset, summary in sizes.items() if dataset in work and "error" not in summary]
+        fit = stats.linear_fit([work[dataset] for dataset in datasets], [sizes[dataset]["median"] for dataset in datasets])
+        if fit is None:
+            print(f"[WARNING] {runtime}: fewer than two successful sizes with a native kernel time, no scaling fit")
+            continue
+        fit["fixed_overhead"] = fit.pop("intercept")
+        fit["datasets"] = datasets
+        fits[runtime] = fit
+        print(f"{runtime}: fixed overhead {fit['fixed_overhead']}s, slope {fit['slope']} "
+              f"(r^2 {fit['r_squared']:.4f}, {len(datasets)} sizes)")
+    return fits
+
+def main(file_name, opt_level, results_dir=RESULTS_DIR, datasets=None, repetitions=REPETITIONS,
+         warmup=times.WARMUP_RUNS, force=False, quiet=False):
+    if repetitions < 1:
+        raise ValueError(f"repetitions must be at least 1, got {repetitions}")
+    if not os.path.exists(results_dir):
+        os.makedirs(results_dir)
+    datasets = datasets or compile.DATASETS
+
+    binaries = build_sizes(file_name, opt_level, datasets, force)
+    with quiet_host.quiet(quiet) as settings:
+        points = measure_sizes(binaries, repetitions, warmup)
+    fits = fit_scaling(points)
+
+    # Same key layout as times.py, so the results store files each runtime's points and fit under it
+    results = {f"{file_name}_{runtime}": {"datasets": sizes, "scaling": fits.get(runtime)}
+               for runtime, sizes in points.items()}
+    if settings:
+        results["quiet_host"] = settings
+
+    json_output_file = os.path.join(results_dir, f"{file_name}_{opt_level}_sweep.json")
+    with open(json_output_file, 'w') as json_file:
+        json.dump(results, json_file, indent=4)
+
+    print(f"Dataset sweep saved to {json_output_file}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure a kernel at every PolyBench dataset size and fit per-runtime scaling curves.')
+    parser.add_argument('file_name', type=str, help='Name of the kernel')
+    parser.add_argument('opt_level', type=int, choices=[0, 1, 2, 3], help='Optimization level (0, 1, 2, 3)')
+    parser.add_argument('--results-dir', type=str, default=RESULTS_DIR, help='Directory to write the results JSON to')
+    parser.add_argument('--datasets', nargs='+', choices=compile.DATASETS, help='Sizes to sweep (default: all, smallest first)')
+    parser.add_argument('--repetitions', type=int, default=REPETITIONS, help='Measured runs per runtime and size')
+    parser.add_argument('--warmup', type=int, default=times.WARMUP_RUNS, help='Unmeasured warmup runs per runtime and size')
+    parser.add_argument('--force', action='store_true', help='Rebuild every size instead of using the compile cache')
+    parser.add_argument('--quiet', action='store_true', help='Pin governor and turbo, run under SCHED_FIFO and flush the LLC before each run')
+    args = parser.parse_args()
+    if args.repetitions < 1:
+        parser.error('--repetitions must be at least 1')
+    main(args.file_name, args.opt_level, args.results_dir, args.datasets, args.repetitions, args.warmup, args.force,
+         args.quiet)
@@ -4,19 +4,33 @@ import subprocess
 import argparse
 import json
 
+import aot
+import compile
+import stats
+import quiet_host
+import runtimes
+import topology
+
 # Directory setup
 COMPILED_DIR = "/root/profiler/compiled"
 RESULTS_DIR = "/root/profiler/results/times"
 
 # Runtimes
-RUNTIMES = ["wasmer", "wasmtime","wavm","iwasm"]
+RUNTIMES = runtimes.RUNTIMES
+
+# Repeated trials, defaults follow utilities/time_benchmark.sh (5 runs, 5% variance)
+WARMUP_RUNS = 1
+REPETITIONS = 5
+VARIANCE_THRESHOLD = 5.0  # Max deviation in percent from the trimmed mean
+MAX_RERUNS = 2
 
 def check_file_exists(file_path):
     return os.path.isfile(file_path)
 
-def run_native_file(file_path):
+def run_native_file(file_path, kernel_time=False):
+    command = quiet_host.prepare([file_path])
     start_time = time.perf_counter()
-    process = subprocess.run(file_path, capture_output=True, text=True)
+    process = subprocess.run(command, capture_output=True, text=True, preexec_fn=topology.child_pinning())
     end_time = time.perf_counter()
 
     if process.returncode != 0:
@@ -24,21 +38,19 @@ def run_native_file(file_path):
     else:
         print(f"Native Execution Time: {end_time - start_time}s")
 
+    if kernel_time:
+        # A failed run's output is not a kernel time, even if it got as far as printing one
+        return end_time - start_time, runtimes.parse_kernel_time(process.stdout) if process.returncode == 0 else None
     return end_time - start_time
 
-def run_wasm_file(runtime, file_path):
-    command = {
-        "wasmer": ["wasmer", file_path],
-        "wasmtime": ["wasmtime", file_path],
-        "wavm": ["wavm", "run", file_path],
-        "iwasm": ["iwasm", file_path],
-    }.get(runtime)
-
+def run_wasm_file(runtime, file_path, precompiled=False, kernel_time=False):
+    command = runtimes.wasm_command(runtime, file_path, precompiled)
     if not command:
         raise ValueError("Unsupported runtime specified.")
 
+    command = quiet_host.prepare(command)
     start_time = time.perf_counter()
-    process = subprocess.run(command, capture_output=True, text=True)
+    process = subprocess.run(command, capture_output=True, text=True, preexec_fn=topology.child_pinning())
     end_time = time.perf_counter()
 
     if process.returncode != 0:
@@ -46,40 +58,123 @@ def run_wasm_file(runtime, file_path):
     else:
         print(f"{runtime} Execution Time: {end_time - start_time}s")
 
+    if kernel_time:
+        return end_time - start_time, runtimes.parse_kernel_time(process.stdout) if process.returncode == 0 else None
     return end_time - start_time
 
-def main(file_name, opt_level):
-    if not os.path.exists(RESULTS_DIR):
-        os.makedirs(RESULTS_DIR)
-
-    execution_times = {}
-
-    native_file = os.path.join(COMPILED_DIR, f"{file_name}_{opt_level}_native")
-    wasm_file = os.path.join(COMPILED_DIR, f"{file_name}_{opt_level}.wasm")
+def measure_repeated(run, label, warmup=WARMUP_RUNS, repetitions=REPETITIONS,
+                     variance_threshold=VARIANCE_THRESHOLD, max_reruns=MAX_RERUNS, kernel_unit=None):
+    # With kernel_unit set, run() returns (wall time, kernel time in seconds or cycles)
+    for _ in range(warmup):
+        run()
+
+    for attempt in range(max_reruns + 1):
+        runs = [run() for _ in range(repetitions)]
+        samples = [r[0] for r in runs] if kernel_unit else runs
+        stats.report_samples(label, samples)
+        kernel_samples = [r[1] for r in runs] if kernel_unit else []
+        if None in kernel_samples:
+            print(f"[WARNING] {label}: no kernel time from a run, did it fail or was it built without -DPOLYBENCH_TIME?")
+            kernel_samples = []
+        summary = stats.summarize(samples)
+        # Like time_benchmark.sh, judge the variance on the kernel timer when there is one
+        summary.update(stats.polybench_deviation(kernel_samples or samples))
+        if kernel_samples and kernel_unit == "cycles":
+            summary["kernel_cycles"] = stats.summarize(kernel_samples)
+        elif kernel_samples:
+            summary["kernel_time"] = stats.summarize(kernel_samples)
+            summary["startup_overhead"] = stats.summarize([w - k for w, k in zip(samples, kernel_samples)])
+        summary["warmup"] = warmup
+        summary["reruns"] = attempt
+        summary["variance_ok"] = summary["max_deviation_pct"] <= variance_threshold
+        if summary["variance_ok"]:
+            break
+        print(f"[WARNING] {label}: max deviation {summary['max_deviation_pct']:.2f}% above tolerance {variance_threshold}%"
+              f"{', rerunning' if attempt < max_reruns else ''}")
+
+    print(f"{label}: median {summary['median']}s, mean {summary['mean']}s, cv {summary['cv']:.4f}, "
+          f"95% CI {summary['median_ci']}")
+    if "kernel_time" in summary:
+        print(f"{label}: kernel median {summary['kernel_time']['median']}s, "
+              f"startup overhead median {summary['startup_overhead']['median']}s")
+    return summary
+
+def measure_all(file_name, opt_level, execution_times, trials, use_aot=False, kernel_time=False, cycle_accurate=False):
+    # Kernel timing runs the -DPOLYBENCH_TIME build variants from compile.py --variant
+    native_variant = ("cycles" if cycle_accurate else "time") if kernel_time else None
+    wasm_variant = "time" if kernel_time else None
+    native_file = os.path.join(COMPILED_DIR, compile.artifact_name(file_name, opt_level, "native", native_variant))
+    wasm_file = os.path.join(COMPILED_DIR, compile.artifact_name(file_name, opt_level, "wasm", wasm_variant))
+
+    native_unit = ("cycles" if cycle_accurate else "seconds") if kernel_time else None
+    wasm_unit = "seconds" if kernel_time else None
 
     if check_file_exists(native_file):
-        native_exec_time = run_native_file(native_file)
+        native_exec_time = measure_repeated(lambda: run_native_file(native_file, kernel_time), "native", *trials,
+                                            kernel_unit=native_unit)
         execution_times[f"{file_name}_native"] = native_exec_time
     else:
         print(f"Native file {native_file} does not exist.")
 
     if check_file_exists(wasm_file):
         for runtime in RUNTIMES:
-            wasm_exec_time = run_wasm_file(runtime, wasm_file)
+            if use_aot:
+                # Compile outside the timed runs so only execution of the artifact is measured
+                try:
+                    precompiled = aot.precompile(runtime, wasm_file)
+                except (OSError, RuntimeError) as e:
+                    print(f"Error: {e}")
+                    execution_times[f"{file_name}_{runtime}"] = {"error": str(e)}
+                    continue
+                wasm_exec_time = measure_repeated(lambda: run_wasm_file(runtime, precompiled["artifact"], True, kernel_time),
+                                                  f"{runtime} (AOT)", *trials, kernel_unit=wasm_unit)
+                wasm_exec_time["aot_compile_time"] = precompiled["compile_time"]
+                wasm_exec_time["aot_cache_hit"] = precompiled["cache_hit"]
+            else:
+                wasm_exec_time = measure_repeated(lambda: run_wasm_file(runtime, wasm_file, kernel_time=kernel_time), runtime,
+                                                  *trials, kernel_unit=wasm_unit)
             execution_times[f"{file_name}_{runtime}"] = wasm_exec_time
     else:
         print(f"WASM file {wasm_file} does not exist.")
 
-    json_output_file = os.path.join(RESULTS_DIR, f"{file_name}_{opt_level}_times.json")
+def main(file_name, opt_level, results_dir=RESULTS_DIR, warmup=WARMUP_RUNS, repetitions=REPETITIONS,
+         variance_threshold=VARIANCE_THRESHOLD, max_reruns=MAX_RERUNS, use_aot=False, kernel_time=False,
+         cycle_accurate=False, quiet=False):
+    if repetitions < 1:
+        raise ValueError(f"repetitions must be at least 1, got {repetitions}")
+    if not os.path.exists(results_dir):
+        os.makedirs(results_dir)
+
+    execution_times = {}
+    with quiet_host.quiet(quiet) as settings:
+        measure_all(file_name, opt_level, execution_times, (warmup, repetitions, variance_threshold, max_reruns),
+                    use_aot, kernel_time, cycle_accurate)
+    if settings:
+        execution_times["quiet_host"] = settings
+
+    json_output_file = os.path.join(results_dir, f"{file_name}_{opt_level}_times.json")
     with open(json_output_file, 'w') as json_file:
         json.dump(execution_times, json_file, indent=4)
 
     print(f"Execution times saved to {json_output_file}")
+    return execution_times
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Measure execution times of a native binary and a WASM file.')
     parser.add_argument('file_name', type=str, help='Name of the file to execute')
     parser.add_argument('opt_level', type=int, choices=[0, 1, 2, 3], help='Optimization level (0, 1, 2, 3)')
+    parser.add_argument('--results-dir', type=str, default=RESULTS_DIR, help='Directory to write the results JSON to')
+    parser.add_argument('--warmup', type=int, default=WARMUP_RUNS, help='Unmeasured warmup runs per runtime')
+    parser.add_argument('--repetitions', type=int, default=REPETITIONS, help='Measured runs per runtime')
+    parser.add_argument('--variance-threshold', type=float, default=VARIANCE_THRESHOLD, help='Max accepted deviation in percent')
+    parser.add_argument('--max-reruns', type=int, default=MAX_RERUNS, help='Reruns of a runtime whose deviation exceeds the threshold')
+    parser.add_argument('--use-aot', action='store_true', help='Run ahead-of-time compiled artifacts of the WASM file')
+    parser.add_argument('--kernel-time', action='store_true', help='Run the -DPOLYBENCH_TIME builds and report kernel time and startup overhead')
+    parser.add_argument('--cycle-accurate', action='store_true', help='With --kernel-time, use the native cycle-accurate timer build')
+    parser.add_argument('--quiet', action='store_true', help='Pin governor and turbo, run under SCHED_FIFO and flush the LLC before each run')
     args = parser.parse_args()
-    main(args.file_name, args.opt_level)
+    if args.repetitions < 1:
+        parser.error('--repetitions must be at least 1')
+    main(args.file_name, args.opt_level, args.results_dir, args.warmup, args.repetitions,
+         args.variance_threshold, args.max_reruns, args.use_aot, args.kernel_time, args.cycle_accurate, args.quiet)
 
@@ -0,0 +1,154 @@
+import os
+import ctypes
+import platform
+import threading
+import contextlib
+
+# Host topology from sysfs, and a scheduler handing out one physical core per concurrent measurement
+CPU_ROOT = "/sys/devices/system/cpu"
+NODE_ROOT = "/sys/devices/system/node"
+
+MPOL_DEFAULT = 0
+MPOL_BIND = 2
+SYS_SET_MEMPOLICY = {"x86_64": 238, "aarch64": 237}
+
+ORIGINAL_AFFINITY = os.sched_getaffinity(0)
+current_lease = None
+
+def parse_cpu_list(text):
+    # sysfs lists look like "0-3,8,10-11"
+    cpus = []
+    for part in text.strip().split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            cpus += range(int(start), int(end) + 1)
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+def read_value(path, default=None):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+def discover(cpu_root=CPU_ROOT, node_root=NODE_ROOT):
+    """Physical cores as {"cpus": [primary, siblings...], "package", "node"}, limited to CPUs we may run on."""
+    allowed = os.sched_getaffinity(0)
+    online = parse_cpu_list(read_value(os.path.join(cpu_root, "online"), "")) or sorted(allowed)
+
+    cpu_nodes = {}
+    if os.path.isdir(node_root):
+        for entry in os.listdir(node_root):
+            if entry.startswith("node") and entry[4:].isdigit():
+                for cpu in parse_cpu_list(read_value(os.path.join(node_root, entry, "cpulist"), "")):
+                    cpu_nodes[cpu] = int(entry[4:])
+
+    cores = {}
+    for cpu in online:
+        topology = os.path.join(cpu_root, f"cpu{cpu}", "topology")
+        package = int(read_value(os.path.join(topology, "physical_package_id"), 0))
+        core_id = int(read_value(os.path.join(topology, "core_id"), cpu))
+        siblings = parse_cpu_list(read_value(os.path.join(topology, "thread_siblings_list"), str(cpu)))
+        cores.setdefault((package, core_id), {"cpus": sorted(siblings), "package": package,
+                                              "node": cpu_nodes.get(cpu, 0)})
+    return [core for core in sorted(cores.values(), key=lambda core: core["cpus"][0]) if core["cpus"][0] in allowed]
+
+def set_memory_node(node):
+    # set_mempolicy(2) has no wrapper in the standard library; the policy is inherited by child processes
+    number = SYS_SET_MEMPOLICY.get(platform.machine())
+    if number is None:
+        return False
+    libc = ctypes.CDLL(None, use_errno=True)
+    if node is None:
+        result = libc.syscall(number, MPOL_DEFAULT, None, 0)
+    else:
+        mask = ctypes.c_ulong(1 << node)
+        result = libc.syscall(number, MPOL_BIND, ctypes.byref(mask), ctypes.sizeof(mask) * 8 + 1)
+    return result == 0
+
+def node_count(node_root=NODE_ROOT):
+    if not os.path.isdir(node_root):
+        return 1
+    return len([entry for entry in os.listdir(node_root) if entry.startswith("node") and entry[4:].isdigit()]) or 1
+
+def pin(lease=None):
+    """Take a lease from CoreScheduler for this process; None undoes an earlier pin.
+
+    The harness moves onto the lease's harness CPUs so its sampler threads and polling stay off the measured
+    CPU; measured children are put on the leased CPUs by child_pinning()."""
+    global current_lease
+    os.sched_setaffinity(0, lease["harness_cpus"] if lease else ORIGINAL_AFFINITY)
+    if node_count() > 1 and not set_memory_node(lease["node"] if lease else None):
+        print(f"[WARNING] Could not bind memory to NUMA node {lease['node'] if lease else None}")
+    current_lease = lease
+
+def measured_cpus():
+    """CPUs a measured child runs on: the leased ones, else wherever this process may run."""
+    return list(current_lease["cpus"]) if current_lease else sorted(os.sched_getaffinity(0))
+
+def child_pinning():
+    """preexec_fn moving a measured child onto the leased CPUs before it execs; None when nothing is leased."""
+    if not current_lease:
+        return None
+    cpus = current_lease["cpus"]
+    return lambda: os.sched_setaffinity(0, cpus)
+
+def container_args():
+    # Containers are started by the Docker daemon and do not inherit our affinity, so the lease is passed on
+    if not current_lease:
+        return []
+    return [f"--cpuset-cpus={','.join(str(cpu) for cpu in current_lease['cpus'])}",
+            f"--cpuset-mems={current_lease['node']}"]
+
+def container_cpuset():
+    # The same placement as container_args(), as HostConfig fields for containers created through the engine API
+    if not current_lease:
+        return {}
+    return {"CpusetCpus": ",".join(str(cpu) for cpu in current_lease["cpus"]), "CpusetMems": str(current_lease["node"])}
+
+class CoreScheduler:
+    """Leases whole physical cores to concurrent measurements; an exclusive lease waits for the host to drain."""
+
+    def __init__(self, cores=None, allowed_cpus=None):
+        cores = cores if cores is not None else discover()
+        if allowed_cpus:
+            cores = [core for core in cores if core["cpus"][0] in allowed_cpus]
+        self.cores = cores
+        self.free = list(cores)
+        self.exclusive_waiting = 0
+        self.exclusive_held = False
+        self.changed = threading.Condition()
+
+    def harness_cpus(self, core):
+        # An idle SMT sibling of the measured CPU, else CPUs no lease measures on; a single-CPU host has to share
+        measured = {c["cpus"][0] for c in self.cores}
+        return ([cpu for cpu in core["cpus"][1:] if cpu in ORIGINAL_AFFINITY] or sorted(ORIGINAL_AFFINITY - measured)
+                or sorted(ORIGINAL_AFFINITY - {core["cpus"][0]}) or [core["cpus"][0]])
+
+    @contextlib.contextmanager
+    def lease(self, exclusive=False):
+        with self.changed:
+            if exclusive:
+                # Waiting exclusive leases hold back new shared ones so they cannot be starved
+                self.exclusive_waiting += 1
+                self.changed.wait_for(lambda: len(self.free) == len(self.cores) and not self.exclusive_held)
+                self.exclusive_waiting -= 1
+                self.exclusive_held = True
+                core = self.cores[0]
+            else:
+                self.changed.wait_for(lambda: self.free and not self.exclusive_waiting and not self.exclusive_held)
+                core = self.free.pop(0)
+        try:
+            # Only the primary thread runs the measurement; the harness gets what is left of the core
+            yield {"cpus": [core["cpus"][0]], "harness_cpus": self.harness_cpus(core), "node": core["node"],
+                   "exclusive": exclusive}
+        finally:
+            with self.changed:
+                if exclusive:
+                    self.exclusive_held = False
+                else:
+                    self.free.append(core)
+                    self.free.sort(key=lambda c: c["cpus"][0])
+                self.changed.notify_all()
@@ -0,0 +1,80 @@
+import os
+import sys
+import json
+import time
+import tarfile
+import argparse
+import subprocess
+
+# Runs every cell of a manifest on the VM in one go and packs the result files into a single archive
+ARCHIVE_NAME = "results.tar.gz"
+STATUS_FILE = "driver_status.json"
+
+def result_file(application_name, opt_level, test_name):
+    test_dir = test_name.replace('.py', '')
+    return os.path.join(test_dir, f"{application_name}_{opt_level}_{test_dir}.json")
+
+def run_cell(manifest, cell):
+    test = cell["test"]
+    test_dir = os.path.join(manifest["results_path"], test["name"].replace('.py', ''))
+    os.makedirs(test_dir, exist_ok=True)
+    # A result left over from an earlier run must not end up in this run's archive
+    stale = os.path.join(manifest["results_path"], result_file(cell["application_name"], cell["opt_level"], test["name"]))
+    if os.path.exists(stale):
+        os.remove(stale)
+    command = (f"python3 {os.path.join(manifest['script_path'], test['name'])} {cell['application_name']} "
+               f"{cell['opt_level']} --results-dir {test_dir} {test.get('cli_args', '')}")
+    print(f"Running {test['name']} {cell['application_name']} {cell['opt_level']}", flush=True)
+    start_time = time.time()
+    # cli_args is already shell-quoted by the controller
+    process = subprocess.run(command, shell=True, capture_output=True, text=True)
+    duration = time.time() - start_time
+    if process.returncode != 0:
+        print(f"Error running {test['name']} for {cell['application_name']} at opt level {cell['opt_level']}: {process.stderr.strip()}", flush=True)
+    return {
+        "application_name": cell["application_name"],
+        "test": test["name"],
+        "opt_level": cell["opt_level"],
+        "returncode": process.returncode,
+        "duration": duration,
+        "stderr": process.stderr[-4000:]
+    }
+
+def shutdown_warm_containers(script_path):
+    sys.path.insert(0, script_path)
+    try:
+        import container_pool
+        container_pool.shutdown()
+    except Exception as e:
+        print(f"Failed to shut down warm containers: {e}", flush=True)
+
+def main(manifest_file):
+    with open(manifest_file, 'r') as f:
+        manifest = json.load(f)
+
+    status = [run_cell(manifest, cell) for cell in manifest["cells"] if cell["test"].get("active", True)]
+
+    if manifest.get("shutdown_warm_containers"):
+        shutdown_warm_containers(manifest["script_path"])
+
+    results_path = manifest["results_path"]
+    with open(os.path.join(results_path, STATUS_FILE), 'w') as f:
+        json.dump(status, f, indent=4)
+
+    archive = os.path.join(results_path, ARCHIVE_NAME)
+    with tarfile.open(archive, "w:gz") as tar:
+        tar.add(os.path.join(results_path, STATUS_FILE), arcname=STATUS_FILE)
+        for cell in status:
+            member = result_file(cell["application_name"], cell["opt_level"], cell["test"])
+            if os.path.exists(os.path.join(results_path, member)):
+                tar.add(os.path.join(results_path, member), arcname=member)
+
+    failed = sum(1 for cell in status if cell["returncode"] != 0)
+    print(f"Ran {len(status)} cell(s), {failed} failed; results packed into {archive}", flush=True)
+    return status
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run all test cells of a profiling manifest on this VM.')
+    parser.add_argument('manifest', type=str, help='Path to the manifest JSON written by the controller')
+    args = parser.parse_args()
+    main(args.manifest)